@@ -0,0 +1,88 @@
+""" autosave of annotations without blocking the GUI thread
+
+edits only mark the annotations as changed: a snapshot is taken at most once per interval, however many
+edits there were (eg. every mouse move while dragging a marker), and written on a worker thread. if writes are
+slower than edits - eg. to a network share - snapshots that are waiting to be written are replaced by newer
+ones rather than queued
+"""
+import json
+import os
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+
+from PyQt5 import QtCore
+
+AUTOSAVE_INTERVAL_MS = 2000
+
+
+def write_json_atomic(path: Union[str, pathlib.Path], data):
+    """ write to a temporary file then rename over the original, so a crash or a dropped network connection
+    mid-write never leaves a partial file """
+    path = pathlib.Path(path)
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_file, path)
+
+
+class Autosaver(QtCore.QObject):
+    """ coalesces change notifications into periodic snapshots, saved on a worker thread
+
+    connect any number of change signals to `markDirty`. `snapshot_function` runs on the GUI thread, so should
+    only copy the current state; `save_function(snapshot)` runs on the worker thread. call `close` before
+    exiting to save any last changes
+    """
+
+    saved = QtCore.pyqtSignal(object) # snapshot, once written
+
+    def __init__(self, snapshot_function: Callable[[], object], save_function: Callable[[object], None],
+                 interval_ms: int = AUTOSAVE_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.snapshot_function = snapshot_function
+        self.save_function = save_function
+        self.dirty = False
+        self.pending = None # latest snapshot not yet picked up by the worker
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.timer = QtCore.QTimer(self, singleShot=True, interval=interval_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def markDirty(self, *args):
+        """ slot for any change signal - arguments are ignored """
+        self.dirty = True
+        if not self.timer.isActive(): # not restarted, so continuous edits still save every interval
+            self.timer.start()
+
+    def flush(self):
+        """ snapshot now, if anything has changed, and hand it to the worker """
+        self.timer.stop()
+        if not self.dirty:
+            return
+        self.dirty = False
+        snapshot = self.snapshot_function()
+        if snapshot is None:
+            return
+        with self.lock:
+            waiting = self.pending is not None
+            self.pending = snapshot
+        if not waiting:
+            self.pool.submit(self.write)
+
+    def write(self):
+        with self.lock:
+            snapshot, self.pending = self.pending, None
+        if snapshot is None:
+            return
+        try:
+            self.save_function(snapshot)
+        except Exception as e:
+            print(f"autosave failed: {e!r}") # todo logging
+            return
+        self.saved.emit(snapshot) # delivered to slots on the GUI thread
+
+    def close(self):
+        """ save any unsaved changes and wait for writes to finish """
+        self.flush()
+        self.pool.shutdown(wait=True)
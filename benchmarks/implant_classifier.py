@@ -0,0 +1,67 @@
+""" microbenchmark: classify synthetic surgery-note implant descriptions
+
+run from the repo root (implant_info.json is read from the current working directory):
+    python -m benchmarks.implant_classifier
+"""
+import random
+from time import perf_counter
+
+import utils
+
+N_DESCRIPTIONS = 100_000
+
+FILLER = ["survived", "headframe", "cement", "craniotomy", "left hemisphere", "good window", "bleeding", "re-implant"]
+
+
+def make_descriptions(implants: list, n: int = N_DESCRIPTIONS, seed: int = 0) -> list:
+    """ free-text descriptions like those in the surgery notes: mostly one implant's search string plus some
+    filler words, a few with no known implant or with two implants mentioned """
+    rng = random.Random(seed)
+    search_strings = [name for i in implants for name in i["search_strings"]]
+    descriptions = []
+    for _ in range(n):
+        words = rng.sample(FILLER, k=rng.randint(1, 4))
+        for _ in range(rng.choices([0, 1, 2], weights=[5, 90, 5])[0]):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(search_strings))
+        descriptions.append(" ".join(words))
+    return descriptions
+
+
+def classify_loop(implants: list, implant_description: str) -> int:
+    """ the original matching loop from `get_implant_type`, for comparison """
+    for i in implants:
+        if any([name in implant_description for name in i["search_strings"]]):
+            return i["index"]
+    return -1
+
+
+def main():
+    classifier = utils.get_implant_classifier()
+    implants = classifier.implants
+    descriptions = make_descriptions(implants)
+
+    t0 = perf_counter()
+    loop_idx = [classify_loop(implants, d) for d in descriptions]
+    t_loop = perf_counter() - t0
+
+    t0 = perf_counter()
+    classifier_idx = classifier.indices(descriptions)
+    t_classifier = perf_counter() - t0
+
+    # both methods must agree, including precedence when several implants are mentioned
+    classifier_idx = [implants[idx]["index"] if idx >= 0 else -1 for idx in classifier_idx]
+    assert loop_idx == classifier_idx, "classifier results differ from original loop"
+
+    t0 = perf_counter()
+    for _ in range(1000):
+        utils.get_implant_classifier()
+    t_cached = (perf_counter() - t0) / 1000
+
+    print(f"{len(descriptions)} descriptions")
+    print(f"original loop:       {t_loop * 1e3:8.1f} ms  ({t_loop / len(descriptions) * 1e6:.2f} us each)")
+    print(f"compiled classifier: {t_classifier * 1e3:8.1f} ms  ({t_classifier / len(descriptions) * 1e6:.2f} us each)")
+    print(f"cached classifier lookup: {t_cached * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
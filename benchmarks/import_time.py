@@ -0,0 +1,97 @@
+""" import-time regression check: headless modules must import quickly, silently, and without pulling in
+pandas or Qt - and the GUI modules must not create a QApplication or window just by being imported. also
+checks that looking up implants from already-parsed surgery notes doesn't import pandas
+
+each module is imported in a fresh interpreter. run from the repo root (modules read files from the current
+working directory):
+    python -m benchmarks.import_time
+"""
+import subprocess
+import sys
+
+# modules used by the command-line tools, which should never need pandas or Qt to import
+HEADLESS_MODULES = [
+    "utils", "probe_labels", "probe_view", "probe_history", "session_index", "insertion_records", "export",
+    "profiling",
+]
+# modules with windows or widgets, which may import Qt but must not do any work on import
+GUI_MODULES = [
+    "pg_tests", "probe_markers", "image_pyramid", "autosave", "folder_watcher", "session_models", "profiling_dock",
+    "thumbnails", "directory_prefetch",
+]
+
+HEAVY_DEPENDENCIES = ["pandas", "PyQt5", "pyqtgraph"]
+
+# generous: numpy alone takes ~100 ms on a cold start
+MAX_HEADLESS_IMPORT_S = 0.5
+
+CHECK = """
+import sys
+from time import perf_counter
+t0 = perf_counter()
+import {module}
+elapsed = perf_counter() - t0
+heavy = [name for name in {heavy!r} if name in sys.modules]
+app = None
+if "PyQt5" in sys.modules:
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication.instance()
+print(repr((elapsed, heavy, app is not None)))
+"""
+
+# surgery notes parsed on a previous run: a lookup from the pickled copy, then from the in-memory copy
+CACHED_LOOKUP_CHECK = """
+import pathlib, pickle, sys, tempfile
+import utils
+folder = pathlib.Path(tempfile.mkdtemp())
+xlsx_file, cache_file = folder / "surgery_notes.xlsx", folder / "surgery_notes_index.pkl"
+xlsx_file.write_bytes(b"not parsed")
+index = {"signature": utils.file_signature(xlsx_file), "descriptions": {366122: "TS-4"}, "duplicates": set()}
+cache_file.write_bytes(pickle.dumps(index))
+for _ in range(2):
+    assert utils.get_surgery_notes_index(xlsx_file, cache_file) == index
+print(repr("pandas" in sys.modules))
+"""
+
+
+def cached_lookup_imports_pandas() -> bool:
+    """ whether a surgery notes lookup that doesn't need to parse the spreadsheet imports pandas """
+    result = subprocess.run([sys.executable, "-c", CACHED_LOOKUP_CHECK], capture_output=True, text=True, check=True)
+    return eval(result.stdout.splitlines()[-1])
+
+
+def import_module(module: str) -> tuple:
+    """ import a module in a new interpreter
+
+    Returns:
+        tuple: (seconds to import, heavy dependencies loaded, whether a QApplication exists, anything else printed)
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+        capture_output=True, text=True, check=True,
+    )
+    *output, summary = result.stdout.splitlines()
+    return (*eval(summary), output)
+
+
+def main():
+    failures = []
+    for module in HEADLESS_MODULES + GUI_MODULES:
+        elapsed, heavy, app_created, output = import_module(module)
+        print(f"{module:20} {elapsed * 1e3:7.1f} ms  {', '.join(heavy)}")
+        if output:
+            failures.append(f"{module} printed on import: {output}")
+        if app_created:
+            failures.append(f"{module} created a QApplication on import")
+        if module in HEADLESS_MODULES:
+            if heavy:
+                failures.append(f"{module} imported {heavy}")
+            if elapsed > MAX_HEADLESS_IMPORT_S:
+                failures.append(f"{module} took {elapsed:.2f} s to import")
+    if cached_lookup_imports_pandas():
+        failures.append("surgery notes lookup from the cached index imported pandas")
+    assert not failures, "\n".join(failures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" microbenchmark: convert millions of probe labels <-> indices, as in a bulk export
+
+run from the repo root:
+    python -m benchmarks.probe_labels
+
+fails if the vectorized conversion disagrees with the per-element version, or gets slower than
+MAX_NS_PER_LABEL
+"""
+from time import perf_counter
+
+import numpy as np
+
+import probe_labels
+
+N_LABELS = 6_000_000
+N_LOOP = 100_000 # the per-element version is only timed on a subset
+
+# generous: the lookup tables manage a few ns per label, a per-element python loop hundreds
+MAX_NS_PER_LABEL = 50
+
+
+def idx2chr_loop(probe_idx) -> list:
+    """ the per-element conversion previously in pg_tests.py / probe_view.Probe, for comparison """
+    return [chr(ord("A") + idx) for idx in probe_idx]
+
+
+def chr2idx_loop(probe_chr) -> list:
+    return [ord(label.upper()) - ord("A") for label in probe_chr]
+
+
+def best_of(function, *args, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        function(*args)
+        times.append(perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    probe_idx = rng.integers(0, probe_labels.MAX_PROBES, N_LABELS)
+    labels = probe_labels.PROBE_LABELS[probe_idx]
+    labels[::2] = np.char.lower(labels[::2])
+
+    # both methods must agree
+    assert idx2chr_loop(probe_idx[:N_LOOP].tolist()) == probe_labels.idx2chr(probe_idx[:N_LOOP]).tolist()
+    assert chr2idx_loop(labels[:N_LOOP].tolist()) == probe_labels.chr2idx(labels[:N_LOOP]).tolist()
+
+    t_idx2chr_loop = best_of(idx2chr_loop, probe_idx[:N_LOOP].tolist()) / N_LOOP
+    t_chr2idx_loop = best_of(chr2idx_loop, labels[:N_LOOP].tolist()) / N_LOOP
+    t_idx2chr = best_of(probe_labels.idx2chr, probe_idx) / N_LABELS
+    t_chr2idx = best_of(probe_labels.chr2idx, labels) / N_LABELS
+
+    print(f"{N_LABELS} labels")
+    print(f"idx2chr  per-element loop: {t_idx2chr_loop * 1e9:7.1f} ns each   lookup table: {t_idx2chr * 1e9:5.1f} ns each")
+    print(f"chr2idx  per-element loop: {t_chr2idx_loop * 1e9:7.1f} ns each   lookup table: {t_chr2idx * 1e9:5.1f} ns each")
+
+    assert t_idx2chr * 1e9 < MAX_NS_PER_LABEL, f"idx2chr slower than {MAX_NS_PER_LABEL} ns per label"
+    assert t_chr2idx * 1e9 < MAX_NS_PER_LABEL, f"chr2idx slower than {MAX_NS_PER_LABEL} ns per label"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+""" benchmark suite for the session browser and probe viewer, run against a synthetic tree of session folders
+(see benchmarks/synthetic_tree.py), with results saved as json so versions can be compared
+
+run from the repo root (implant_info.json is read from the current working directory):
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+
+    --latency-ms 5   slows every python filesystem call by 5 ms, like a distant network share
+
+measures:
+    - time to first result: from an empty session index, and from the file model as folders are expanded
+    - filter latency of the browser's SessionFilterProxyModel, for each kind of filter
+    - implant lookups from utils for the tree's mice, against a synthetic surgery notes spreadsheet
+    - render time of the probe viewer's marker layer, for a day's markers up to a cohort's history
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+from time import perf_counter, sleep
+
+import numpy as np
+
+from benchmarks.synthetic_tree import N_SESSIONS, injected_latency, make_surgery_notes, make_tree
+
+REPEATS = 20
+
+# give up waiting for the file model after this many seconds
+FILE_MODEL_TIMEOUT = 120
+
+
+def timed_median(function, repeats: int = REPEATS) -> float:
+    """ median seconds per call """
+    times = []
+    for _ in range(repeats):
+        t0 = perf_counter()
+        function()
+        times.append(perf_counter() - t0)
+    return median(times)
+
+
+def process_events_until(app, condition, timeout: float) -> bool:
+    deadline = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > deadline:
+            return False
+        app.processEvents()
+        sleep(0.001)
+    return True
+
+
+def bench_session_index(tree: dict, folder: pathlib.Path, latency: float) -> dict:
+    from session_index import SessionIndex
+
+    mouse_id = tree["mouse_ids"][0]
+    session_index = SessionIndex(folder / "session_index.sqlite")
+    with injected_latency(latency):
+        t0 = perf_counter()
+        session_index.refresh(tree["roots"])
+        first_result = session_index.find(str(mouse_id))
+        t_first = perf_counter() - t0
+        # second crawl of the same roots, as on every start of the browser
+        t_recrawl = timed_median(lambda: session_index.refresh(tree["roots"]), repeats=3)
+    assert first_result, "no sessions found in index"
+    return {
+        "index_time_to_first_result_s": t_first,
+        "index_recrawl_unchanged_s": t_recrawl,
+        "index_find_mouse_id_ms": timed_median(lambda: session_index.find(str(mouse_id))) * 1e3,
+        "index_find_text_ms": timed_median(lambda: session_index.find("_2022")) * 1e3,
+    }
+
+
+def bench_proxy_filter(app, tree: dict) -> dict:
+    from PyQt5 import QtCore, QtWidgets
+
+    from session_index import parse_session_name
+    from session_models import SessionFilterProxyModel
+
+    # as set up in qabs_model_test.py
+    file_model = QtWidgets.QFileSystemModel()
+    file_model.setFilter(QtCore.QDir.AllDirs | QtCore.QDir.NoDotAndDotDot)
+    proxy_model = SessionFilterProxyModel()
+    proxy_model.setSourceModel(file_model)
+    proxy_model.setFilterKeyColumn(0)
+    proxy_model.setDynamicSortFilter(True)
+    proxy_model.setRecursiveFilteringEnabled(True)
+
+    mouse_id = tree["mouse_ids"][0]
+
+    def onDirectoryLoaded(path: str):
+        # expand every folder down to the sessions, as a user would: map the folder into the proxy so its rows
+        # are filtered, and list each subfolder that isn't a session
+        parent = file_model.index(path)
+        proxy_model.rowCount(proxy_model.mapFromSource(parent))
+        for row in range(file_model.rowCount(parent)):
+            child = file_model.index(row, 0, parent)
+            if parse_session_name(child.data()) is None:
+                file_model.fetchMore(child)
+
+    file_model.directoryLoaded.connect(onDirectoryLoaded)
+
+    # time to first result: from setting the filter on an empty model
+    t0 = perf_counter()
+    proxy_model.setSessionFilter(str(mouse_id))
+    file_model.setRootPath(str(pathlib.Path(tree["roots"][0]).parent))
+    found = process_events_until(app, lambda: proxy_model.matchedSourceIndexes(), FILE_MODEL_TIMEOUT)
+    t_first = perf_counter() - t0
+    assert found, "file model never found a matching session"
+
+    loaded = process_events_until(app, lambda: len(proxy_model.session_indexes) >= len(tree["sessions"]),
+                                  FILE_MODEL_TIMEOUT)
+    assert loaded, "file model never loaded all sessions"
+    t_all = perf_counter() - t0
+
+    def show_filtered(set_filter, value):
+        """ set a filter, then visit every row left in the proxy, as a fully expanded tree view would - the
+        proxy filters lazily, so without this invalidating the filter would be all that's measured """
+        set_filter(value)
+        stack = [QtCore.QModelIndex()]
+        while stack:
+            parent = stack.pop()
+            for row in range(proxy_model.rowCount(parent)):
+                index = proxy_model.index(row, 0, parent)
+                if parse_session_name(index.data()) is None:
+                    stack.append(index)
+
+    mouse_paths = [os.path.join(root, relpath) for root, relpath, _, m, _ in tree["sessions"] if m == mouse_id]
+    results = {
+        "proxy_time_to_first_result_s": t_first,
+        "proxy_time_to_all_sessions_s": t_all,
+        "proxy_filter_mouse_id_ms": timed_median(
+            lambda: show_filtered(proxy_model.setSessionFilter, str(mouse_id))) * 1e3,
+        "proxy_filter_text_ms": timed_median(lambda: show_filtered(proxy_model.setSessionFilter, "_202203")) * 1e3,
+    }
+    proxy_model.setSessionFilter("")
+    results["proxy_filter_accepted_paths_ms"] = timed_median(
+        lambda: show_filtered(proxy_model.setAcceptedPaths, mouse_paths)) * 1e3
+    return results
+
+
+def bench_implant_lookup(tree: dict, folder: pathlib.Path) -> dict:
+    """ utils' implant lookups for the tree's mice, against a synthetic surgery notes spreadsheet: parsing it
+    (cold, as after it's edited), from the pickled index (a new session) and from the in-memory index (warm) """
+    import utils
+
+    mouse_ids = tree["mouse_ids"]
+    xlsx_file = make_surgery_notes(folder / "surgery_notes.xlsx", mouse_ids, utils.get_implants())
+    cache_file = folder / "surgery_notes_index.pkl"
+
+    def cold():
+        cache_file.unlink(missing_ok=True)
+        utils._surgery_notes_indexes.clear()
+        utils.get_implant_types(mouse_ids)
+
+    def from_pickle():
+        utils._surgery_notes_indexes.clear()
+        utils.get_implant_types(mouse_ids)
+
+    defaults = utils.SURGERY_NOTES_XLSX, utils.SURGERY_NOTES_CACHE
+    utils.SURGERY_NOTES_XLSX, utils.SURGERY_NOTES_CACHE = xlsx_file, cache_file
+    try:
+        # lookups report mice with no known implant - a few percent of the synthetic descriptions
+        with contextlib.redirect_stdout(io.StringIO()):
+            t_cold = timed_median(cold, repeats=3)
+            t_pickle = timed_median(from_pickle, repeats=5)
+            t_warm_batch = timed_median(lambda: utils.get_implant_types(mouse_ids))
+            t_warm_single = timed_median(lambda: [utils.get_implant_type(mouse_id) for mouse_id in mouse_ids])
+    finally:
+        utils.SURGERY_NOTES_XLSX, utils.SURGERY_NOTES_CACHE = defaults
+        utils._surgery_notes_indexes.clear()
+    return {
+        "implant_types_cold_s": t_cold,
+        "implant_types_from_pickle_s": t_pickle,
+        "implant_types_warm_per_s": len(mouse_ids) / t_warm_batch,
+        "implant_type_warm_per_s": len(mouse_ids) / t_warm_single,
+    }
+
+
+def bench_marker_render(app) -> dict:
+    import pyqtgraph as pg
+
+    from probe_markers import ProbeMarkerLayer
+
+    pg.setConfigOptions(imageAxisOrder='row-major')
+    image_view = pg.ImageView()
+    image_view.setImage(np.random.default_rng(0).normal(size=(1000, 1000)))
+    image_view.resize(800, 800)
+    layer = ProbeMarkerLayer()
+    image_view.addItem(layer)
+    image_view.show()
+    app.processEvents()
+
+    results = {}
+    rng = np.random.default_rng(0)
+    for n in (6, 180, 6000): # one day, a mouse's month, a cohort's history
+        positions = rng.random((n, 2)) * 1000
+        probe_idx = np.arange(n) % 6
+
+        def render():
+            layer.setMarkers(positions, probe_idx)
+            image_view.grab()
+        results[f"marker_render_{n}_ms"] = timed_median(render, repeats=5) * 1e3
+    results["marker_move_one_ms"] = timed_median(
+        lambda: (layer.moveMarkers(0, rng.random(2) * 1000), image_view.grab()), repeats=10
+    ) * 1e3
+    image_view.close()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, previous: dict):
+    print(f"\n{'':40} {'previous':>12} {'now':>12}")
+    for name, value in results.items():
+        before = previous.get(name)
+        ratio = f"{value / before:6.2f}x" if before else ""
+        print(f"{name:40} {before if before is not None else float('nan'):12.3f} {value:12.3f}  {ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the session browser and probe viewer")
+    parser.add_argument("--sessions", type=int, default=N_SESSIONS, help="synthetic session folders to make")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to each python filesystem call")
+    parser.add_argument("--output", type=pathlib.Path, help="json file to save results to")
+    parser.add_argument("--compare", type=pathlib.Path, help="json results of a previous run to compare with")
+    args = parser.parse_args()
+
+    if sys.platform != "win32" and not os.environ.get("DISPLAY"):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        folder = pathlib.Path(folder)
+        t0 = perf_counter()
+        tree = make_tree(folder / "roots", args.sessions)
+        print(f"made {args.sessions} sessions in {perf_counter() - t0:.1f} s")
+        results.update(bench_session_index(tree, folder, args.latency_ms / 1e3))
+        results.update(bench_proxy_filter(app, tree))
+        results.update(bench_implant_lookup(tree, folder))
+    results.update(bench_marker_render(app))
+
+    for name, value in results.items():
+        print(f"{name:40} {value:12.3f}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {"sessions": args.sessions, "latency_ms": args.latency_ms},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == '__main__':
+    main()
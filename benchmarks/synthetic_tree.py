@@ -0,0 +1,134 @@
+""" synthetic stand-in for the network roots in qabs_model_test.py's `root_pathlist`, for benchmarks
+
+    python -m benchmarks.synthetic_tree <folder> [--sessions 5000]
+
+makes a few roots shaped like the real ones - some with session folders directly inside (like the rig
+neuropixels_data shares), some with them nested a few levels down (like the production/workgroup shares) -
+holding <lims>_<mouse>_<date> session folders with a nested folder of files and an insertion photo each.
+`make_surgery_notes` writes a matching surgery notes spreadsheet for the same mice
+
+`injected_latency` slows down the filesystem calls the crawler, watcher and prefetcher make (os.scandir,
+os.stat, os.listdir), to stand in for a share with a given round-trip time. it only affects python code in this
+process: Qt's QFileSystemModel makes its own calls, which can't be slowed this way
+"""
+import argparse
+import contextlib
+import os
+import pathlib
+import random
+import struct
+import time
+import zlib
+from typing import List
+
+import utils
+
+N_SESSIONS = 5000
+N_MICE = 200
+N_ROOTS = 4
+FILES_PER_SESSION = 4
+SURGERY_NOTES_ROWS = 5000
+
+
+def tiny_png() -> bytes:
+    """ a valid 1x1 pixel png, as a stand-in insertion photo """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0) # 1x1, 8-bit RGB
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x80\x80\x80")) + chunk(b"IEND", b"")
+
+
+def make_tree(folder, n_sessions: int = N_SESSIONS, n_mice: int = N_MICE, n_roots: int = N_ROOTS,
+              files_per_session: int = FILES_PER_SESSION, seed: int = 0) -> dict:
+    """ write the synthetic roots into a folder
+
+    Returns:
+        dict:
+            "roots" (list): root folders
+            "sessions" (list): [(root, relpath, lims_id, mouse_id, date)] of every session folder made
+            "mouse_ids" (list): every mouse id used
+    """
+    rng = random.Random(seed)
+    png = tiny_png()
+    folder = pathlib.Path(folder)
+    roots = [folder / f"root{idx}" for idx in range(n_roots)]
+    mouse_ids = rng.sample(range(500000, 700000), n_mice)
+    sessions = []
+    for idx in range(n_sessions):
+        root_idx = idx % n_roots
+        root = roots[root_idx]
+        mouse_id = mouse_ids[idx % n_mice]
+        date = 20220101 + rng.randrange(12) * 100 + rng.randrange(28)
+        name = f"{1_000_000_000 + idx}_{mouse_id}_{date}"
+        if root_idx % 2 == 0: # sessions directly in the root
+            relpath = name
+        else:                 # nested: <workgroup>/<rig>/<session>
+            relpath = os.path.join(f"workgroup{idx % 3}", f"rig{idx % 7}", name)
+        session = root / relpath
+        (session / f"{name}_probes").mkdir(parents=True)
+        (session / f"{name}_surface-image1.png").write_bytes(png)
+        for file_idx in range(files_per_session):
+            (session / f"{name}_probes" / f"probe{'ABCDEF'[file_idx % 6]}_{file_idx}.npy").write_bytes(b"")
+        sessions.append((str(root), relpath, 1_000_000_000 + idx, mouse_id, date))
+    return {"roots": [str(root) for root in roots], "sessions": sessions, "mouse_ids": mouse_ids}
+
+
+def make_surgery_notes(xlsx_file, mouse_ids: List[int], implants: list, n_rows: int = SURGERY_NOTES_ROWS,
+                       seed: int = 0) -> pathlib.Path:
+    """ write a stand-in for the surgery notes spreadsheet (see `utils.parse_surgery_notes`): a "Survival
+    Tracking" sheet with a row for each of `mouse_ids`, padded with other mice to `n_rows`, plus the blank rows,
+    notes in the MID column and duplicated mice found in the real one """
+    import openpyxl # only needed to write the spreadsheet - pandas reads it with openpyxl too
+
+    from benchmarks.implant_classifier import make_descriptions
+
+    rng = random.Random(seed)
+    others = rng.sample(sorted(set(range(300000, 500000)) - set(mouse_ids)), max(0, n_rows - len(mouse_ids)))
+    all_ids = list(mouse_ids) + others
+    descriptions = make_descriptions(implants, len(all_ids), seed)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(utils.SURGERY_NOTES_SHEET)
+    sheet.append(["Date", "MID", "Type", "Surgeon", "Notes"])
+    for idx, (mouse_id, description) in enumerate(zip(all_ids, descriptions)):
+        sheet.append([f"2022-{1 + idx % 12:02d}-01", mouse_id, description, "surgeon", rng.choice(["", "ok", "redo"])])
+        if idx % 100 == 99:
+            sheet.append([None, "see notes", None, None, None])
+            sheet.append([None, None, None, None, None])
+        if idx % 500 == 499: # second row for a mouse that isn't in the tree
+            sheet.append(["2022-12-31", others[idx % len(others)] if others else mouse_id, description, "", ""])
+    workbook.save(xlsx_file)
+    return pathlib.Path(xlsx_file)
+
+
+@contextlib.contextmanager
+def injected_latency(seconds: float, functions: List[str] = ("scandir", "stat", "listdir")):
+    """ sleep for `seconds` before every call of the given os functions, while in this context """
+    originals = {name: getattr(os, name) for name in functions}
+
+    def slowed(function):
+        def wrapper(*args, **kwargs):
+            time.sleep(seconds)
+            return function(*args, **kwargs)
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(os, name, slowed(function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(os, name, function)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="make a synthetic tree of session folders")
+    parser.add_argument("folder", type=pathlib.Path)
+    parser.add_argument("--sessions", type=int, default=N_SESSIONS)
+    args = parser.parse_args()
+    tree = make_tree(args.folder, args.sessions)
+    print(f"made {len(tree['sessions'])} sessions in {tree['roots']}")
+
+
+if __name__ == '__main__':
+    main()
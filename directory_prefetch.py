@@ -0,0 +1,125 @@
+""" listings of the folders on screen in the session folder browser (qabs_model_test.py), fetched ahead of
+time on worker threads
+
+each folder is listed with one os.scandir call - a single round trip to a network share, with the stat info
+for every entry included - and kept in a bounded cache that models read instead of the filesystem. listing the
+folders on screen before they're expanded also warms the OS's directory cache for the share, so the file
+model's own per-entry stats when a folder is expanded are answered locally
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Iterable, List, NamedTuple, Union
+
+from PyQt5 import QtCore
+
+# folders whose listings are kept: least recently used are dropped
+DIRECTORY_CACHE_MAX_FOLDERS = 2000
+
+# seconds a listing is trusted for: folders change after they're listed (eg. a rig adding a subfolder to a new
+# session folder), so older listings are treated as missing and listed again
+DIRECTORY_CACHE_MAX_AGE_S = 30
+
+# folders listed at once - each is mostly waiting on the network
+PREFETCH_WORKERS = 8
+
+
+class DirEntryInfo(NamedTuple):
+    name: str
+    is_dir: bool
+    mtime_ns: int
+    size: int
+
+
+def list_directory(folder: str) -> List[DirEntryInfo]:
+    """ entries of a folder, sorted by name, from a single directory listing """
+    entries = []
+    with os.scandir(folder) as scan:
+        for entry in scan:
+            try:
+                stat = entry.stat()
+                entries.append(DirEntryInfo(entry.name, entry.is_dir(), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                continue
+    return sorted(entries)
+
+
+class DirectoryCache:
+    """ LRU of folder listings, {folder: (time listed, [DirEntryInfo])}, safe to use from several threads -
+    listings older than `max_age` are dropped when next read """
+
+    def __init__(self, max_folders: int = DIRECTORY_CACHE_MAX_FOLDERS, max_age: float = DIRECTORY_CACHE_MAX_AGE_S):
+        self.max_folders = max_folders
+        self.max_age = max_age
+        self.listings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, folder) -> bool:
+        return self.get(folder) is not None
+
+    def get(self, folder: str) -> Union[List[DirEntryInfo], None]:
+        key = os.path.normpath(folder)
+        with self.lock:
+            if key not in self.listings:
+                return None
+            listed, entries = self.listings[key]
+            if monotonic() - listed > self.max_age:
+                del self.listings[key]
+                return None
+            self.listings.move_to_end(key)
+            return entries
+
+    def put(self, folder: str, entries: List[DirEntryInfo]):
+        with self.lock:
+            self.listings[os.path.normpath(folder)] = (monotonic(), entries)
+            self.listings.move_to_end(os.path.normpath(folder))
+            while len(self.listings) > self.max_folders:
+                self.listings.popitem(last=False)
+
+    def discard(self, folder: str):
+        """ forget a listing that's known to be out of date """
+        with self.lock:
+            self.listings.pop(os.path.normpath(folder), None)
+
+    def listing(self, folder: str) -> List[DirEntryInfo]:
+        """ cached listing of a folder, listing it now if it isn't cached """
+        entries = self.get(folder)
+        if entries is None:
+            entries = list_directory(folder)
+            self.put(folder, entries)
+        return entries
+
+
+class DirectoryPrefetcher(QtCore.QObject):
+    """ lists folders into a DirectoryCache on a pool of worker threads, skipping any already cached or being
+    listed """
+
+    directoryListed = QtCore.pyqtSignal(str) # folder
+
+    def __init__(self, cache: DirectoryCache = None, max_workers: int = PREFETCH_WORKERS, parent=None):
+        super().__init__(parent)
+        self.cache = cache or DirectoryCache()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def prefetch(self, folders: Iterable[str]):
+        for folder in folders:
+            folder = os.path.normpath(folder)
+            with self.lock:
+                if folder in self.pending or folder in self.cache:
+                    continue
+                self.pending.add(folder)
+            self.pool.submit(self.fetch, folder)
+
+    def fetch(self, folder: str):
+        try:
+            self.cache.put(folder, list_directory(folder))
+        except OSError:
+            return # unreachable or not a folder: the file model will report it
+        finally:
+            with self.lock:
+                self.pending.discard(folder)
+        self.directoryListed.emit(folder) # delivered to slots on the GUI thread
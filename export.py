@@ -0,0 +1,120 @@
+""" headless export of probe locations for a cohort: no display or QApplication needed
+
+reads the annotations saved by the viewer in every indexed session folder, in parallel worker processes, and
+writes one table with a row per probe per annotated photo:
+    python export.py cohort.csv --mouse 366122 366123 --start 20220501 --end 20220531
+"""
+import argparse
+import csv
+import json
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Union
+
+import utils
+from insertion_records import ANNOTATIONS_SUFFIX
+from probe_history import NO_HOLE
+from probe_labels import MAX_PROBES
+from probe_view import ProbeSet
+from session_index import SessionIndex
+
+EXPORT_COLUMNS = ("session", "mouse_id", "date", "implant", "probe", "x", "y", "hit_hole", "notes", "image_path")
+
+
+def read_session_annotations(session_path: str) -> list:
+    """ probes that were placed or have notes, for every annotated photo in a session folder - runs in a worker
+    process, so only the rows are sent back
+
+    Returns:
+        list: [(image path, probe index, x, y, hit hole, notes)], with x, y empty for probes not placed and the
+        hit hole empty where it isn't known - including files saved before holes were assigned
+    """
+    rows = []
+    for annotations_file in sorted(pathlib.Path(session_path).rglob(f"*{ANNOTATIONS_SUFFIX}")):
+        # a file missing keys, or with values of the wrong type, is skipped whole rather than stopping the export
+        try:
+            annotations = json.loads(annotations_file.read_text())
+            file_rows = []
+            hit_holes = annotations.get("hit_holes") or [NO_HOLE] * len(annotations["probe_idx"])
+            for probe_idx, placed, (x, y), hit_hole, notes in zip(
+                annotations["probe_idx"], annotations["placed"], annotations["positions"], hit_holes,
+                annotations["notes"],
+            ):
+                if not 0 <= int(probe_idx) < MAX_PROBES:
+                    raise ValueError(f"{probe_idx=} out of range")
+                if placed or notes:
+                    file_rows.append((annotations["image_path"], int(probe_idx), x if placed else "",
+                                      y if placed else "", "" if int(hit_hole) == NO_HOLE else int(hit_hole), notes))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"skipped {annotations_file}: {e!r}") # todo logging
+            continue
+        rows += file_rows
+    return rows
+
+
+def export_cohort(output_file: Union[str, pathlib.Path], session_index: SessionIndex = None,
+                  mouse_ids: Iterable[int] = None, start_date: int = None, end_date: int = None,
+                  max_workers: int = None) -> int:
+    """ write a csv of probe locations for indexed sessions, optionally for a list of mice and/or range of dates
+
+    session folders are read in a pool of `max_workers` processes (default: one per core) and rows are written
+    as each session's results arrive, in date order
+
+    Returns:
+        int: number of rows written
+    """
+    session_index = session_index or SessionIndex()
+    sessions = session_index.sessions(mouse_ids, start_date, end_date)
+
+    # one read of the surgery notes for the whole cohort
+    implants = utils.get_implant_types({mouse_id for *_, mouse_id, _ in sessions})
+
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(sessions) // (4 * max_workers))
+    session_paths = [os.path.join(root, relpath) for root, relpath, *_ in sessions]
+
+    # written under a temporary name and renamed once complete, so a failed export never leaves a partial csv
+    output_file = pathlib.Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + ".tmp")
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as pool, open(tmp_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        results = pool.map(read_session_annotations, session_paths, chunksize=chunksize)
+        for (root, relpath, name, mouse_id, date), rows in zip(sessions, results):
+            if not rows:
+                continue
+            image_paths, probe_idx, x, y, hit_holes, notes = zip(*rows)
+            labels = ProbeSet(probe_idx).labels # one vectorized lookup per session
+            implant = implants.get(mouse_id)
+            implant_type = implant["type"] if implant else ""
+            writer.writerows(zip(
+                [name] * len(rows), [mouse_id] * len(rows), [date] * len(rows), [implant_type] * len(rows),
+                labels, x, y, hit_holes, notes, image_paths,
+            ))
+            n_rows += len(rows)
+    os.replace(tmp_file, output_file)
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export probe locations for a cohort to csv")
+    parser.add_argument("output_file", type=pathlib.Path)
+    parser.add_argument("--mouse", type=int, nargs="+", help="6-digit mouseIDs (default: all)")
+    parser.add_argument("--start", type=int, help="first session date, yyyymmdd")
+    parser.add_argument("--end", type=int, help="last session date, yyyymmdd")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--refresh", type=pathlib.Path, nargs="+", metavar="ROOT",
+                        help="re-crawl these roots for session folders before exporting")
+    args = parser.parse_args()
+
+    session_index = SessionIndex()
+    if args.refresh:
+        session_index.refresh(args.refresh)
+    n_rows = export_cohort(args.output_file, session_index, args.mouse, args.start, args.end, args.workers)
+    print(f"wrote {n_rows} rows to {args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+""" watch the roots for new session folders, so the browser picks them up without a restart or full rescan
+
+local roots use QFileSystemWatcher (inotify, ReadDirectoryChangesW etc.), which doesn't work reliably on
+network shares, so those are polled instead: each poll is one stat per watched folder, comparing its
+modification time to the one stored in the session index. polling backs off while nothing changes
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from PyQt5 import QtCore
+
+from session_index import SessionIndex
+
+# seconds between polls of a network root: reset to the minimum when something changes, doubled each time
+# nothing does
+POLL_INTERVAL_MIN = 5
+POLL_INTERVAL_MAX = 300
+
+
+def is_network_path(path: str) -> bool:
+    """ UNC paths (\\\\server\\share) are on the network """
+    return str(path).startswith(("\\\\", "//"))
+
+
+def changed_folders(root: str, folder_mtimes: dict) -> list:
+    """ relpaths of folders whose modification time differs from `folder_mtimes` {relpath: mtime_ns} """
+    changed = []
+    for relpath, mtime in folder_mtimes.items():
+        try:
+            if os.stat(os.path.join(root, relpath) if relpath else root).st_mtime_ns != mtime:
+                changed.append(relpath)
+        except OSError:
+            continue
+    return changed
+
+
+class SessionFolderWatcher(QtCore.QObject):
+    """ keeps a SessionIndex up to date as session folders are added, re-crawling only the folders that changed
+
+    watched folders are each root plus the folders that already contain sessions (see
+    `SessionIndex.watch_folders`) - new top-level folders elsewhere are found by the next full refresh
+    """
+
+    sessionsAdded = QtCore.pyqtSignal(str, list) # root, relpaths of new session folders
+    pollFinished = QtCore.pyqtSignal(str, bool)  # root, whether anything changed - internal, for the timers
+
+    def __init__(self, session_index: SessionIndex, parent=None):
+        super().__init__(parent)
+        self.session_index = session_index
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        self.local_watcher = QtCore.QFileSystemWatcher(self)
+        self.local_watcher.directoryChanged.connect(self.onDirectoryChanged)
+        self.local_roots = set()
+        self.local_folders = {}   # {watched path: (root, relpath)}
+        self.poll_timers = {}     # {root: QTimer}
+        self.poll_intervals = {}  # {root: seconds}
+        self.pollFinished.connect(self.schedulePoll)
+        self.sessionsAdded.connect(self.onSessionsAdded)
+
+    def watch(self, roots: Iterable):
+        for root in map(str, roots):
+            if is_network_path(root):
+                if root not in self.poll_timers:
+                    timer = QtCore.QTimer(self, singleShot=True)
+                    timer.timeout.connect(lambda root=root: self.pool.submit(self.poll, root))
+                    self.poll_timers[root] = timer
+                self.poll_intervals[root] = POLL_INTERVAL_MIN
+                self.poll_timers[root].start(POLL_INTERVAL_MIN * 1000)
+            else:
+                self.watchLocal(root)
+
+    def watchLocal(self, root: str):
+        self.local_roots.add(root)
+        for relpath in self.session_index.watch_folders(root):
+            path = os.path.join(root, relpath) if relpath else root
+            if path not in self.local_folders:
+                self.local_folders[path] = (root, relpath)
+                self.local_watcher.addPath(path)
+
+    def onSessionsAdded(self, root: str, relpaths: list):
+        # new sessions may be in folders that weren't watched before
+        if root in self.local_roots:
+            self.watchLocal(root)
+
+    def onDirectoryChanged(self, path: str):
+        if path in self.local_folders:
+            self.pool.submit(self.refresh, *self.local_folders[path])
+
+    def refresh(self, root: str, relpath: str):
+        """ re-crawl a changed folder on a worker thread, signalling any new sessions """
+        new_sessions = self.session_index.refresh_folder(root, relpath)
+        if new_sessions:
+            self.sessionsAdded.emit(root, new_sessions)
+
+    def poll(self, root: str):
+        """ check a network root's watched folders for changes on a worker thread, re-crawling any that have """
+        changed = []
+        try:
+            changed = changed_folders(root, self.session_index.watch_folders(root))
+            for relpath in changed:
+                self.refresh(root, relpath)
+        finally:
+            self.pollFinished.emit(root, bool(changed))
+
+    def schedulePoll(self, root: str, changed: bool):
+        if changed:
+            self.poll_intervals[root] = POLL_INTERVAL_MIN
+        else:
+            self.poll_intervals[root] = min(self.poll_intervals[root] * 2, POLL_INTERVAL_MAX)
+        self.poll_timers[root].start(self.poll_intervals[root] * 1000)
+
+    def stop(self):
+        for timer in self.poll_timers.values():
+            timer.stop()
+        if self.local_folders:
+            self.local_watcher.removePaths(list(self.local_folders))
+        self.local_folders.clear()
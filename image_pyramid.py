@@ -0,0 +1,331 @@
+""" multi-resolution loading of large insertion photos for the probe viewer (pg_tests.py)
+
+each photo is decoded once into a pyramid of downsampled levels, cached on disk as .npy files and read back
+memory-mapped. the viewer shows the coarsest level straight away, then fills in the visible region at the
+resolution the current zoom needs - so only about a screenful of full-resolution pixels is ever in memory
+"""
+import hashlib
+import math
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore, QtGui
+
+from utils import file_signature
+
+# pyramid levels for each image (in current working directory)
+IMAGE_CACHE_DIR = pathlib.Path("image_cache")
+
+# longest side of the coarsest level, in pixels
+COARSE_SIZE = 1024
+
+# finer levels are read from disk in square tiles of this many pixels, so panning re-reads little
+TILE_SIZE = 512
+
+# limit on the RAM held by coarse levels of recently viewed images, in bytes
+IMAGE_CACHE_MAX_BYTES = 512 * 2**20
+
+# how many images either side of the one being viewed to load in the background
+PREFETCH_NEIGHBOURS = 2
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def read_image(image_path: Union[str, pathlib.Path]) -> np.ndarray:
+    """ decode an image file with Qt into a row-major (height, width, 3) uint8 RGB array """
+    image = QtGui.QImage(str(image_path))
+    if image.isNull():
+        raise OSError(f"could not read image {image_path}")
+    image = image.convertToFormat(QtGui.QImage.Format_RGB888)
+    height, width, bytes_per_line = image.height(), image.width(), image.bytesPerLine()
+    buffer = image.constBits()
+    buffer.setsize(height * bytes_per_line)
+    # rows are padded to 4-byte boundaries
+    rows = np.frombuffer(buffer, dtype=np.uint8).reshape(height, bytes_per_line)
+    return rows[:, :width * 3].reshape(height, width, 3).copy()
+
+
+def downsample(image: np.ndarray) -> np.ndarray:
+    """ halve an image's resolution by averaging 2x2 blocks (an odd last row/column is dropped) """
+    height, width = image.shape[0] // 2, image.shape[1] // 2
+    blocks = image[:height * 2, :width * 2].reshape(height, 2, width, 2, *image.shape[2:])
+    return (blocks.sum(axis=(1, 3), dtype=np.uint16) // 4).astype(image.dtype)
+
+
+def cache_key(image_path: Union[str, pathlib.Path]) -> str:
+    """ name for an image's cached files - changes if the image file is modified """
+    return hashlib.sha1(repr(file_signature(pathlib.Path(image_path).resolve())).encode()).hexdigest()
+
+
+class ImagePyramid:
+    """ an image at full resolution (level 0) and repeatedly halved, down to `COARSE_SIZE` (last level) """
+
+    def __init__(self, levels: List[np.ndarray]):
+        self.levels = levels
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """ (height, width) at full resolution """
+        return self.levels[0].shape[:2]
+
+    @property
+    def coarsest(self) -> np.ndarray:
+        return self.levels[-1]
+
+    @property
+    def nbytes(self) -> int:
+        """ RAM held by levels that have been read into memory - memory-mapped levels don't count """
+        return sum(level.nbytes for level in self.levels if not isinstance(level, np.memmap))
+
+    def scale(self, level: int) -> int:
+        """ full-resolution pixels per pixel of a level """
+        return 2 ** level
+
+    @classmethod
+    def from_image(cls, image: np.ndarray, coarse_size: int = COARSE_SIZE) -> "ImagePyramid":
+        levels = [image]
+        while max(levels[-1].shape[:2]) > coarse_size:
+            levels.append(downsample(levels[-1]))
+        return cls(levels)
+
+    @classmethod
+    def load(cls, image_path: Union[str, pathlib.Path], cache_dir: pathlib.Path = IMAGE_CACHE_DIR,
+             key: str = None) -> "ImagePyramid":
+        """ pyramid for an image file, decoding and caching it if it hasn't been seen before, otherwise
+        memory-mapping the cached levels """
+        key = key or cache_key(image_path)
+        cache_dir = pathlib.Path(cache_dir)
+        pyramid = cls.load_cached(cache_dir, key)
+        if pyramid is not None:
+            return pyramid
+
+        pyramid = cls.from_image(read_image(image_path))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for idx, level in enumerate(pyramid.levels):
+            # write under a temporary name that doesn't match the level files, so a partly-written level is
+            # never loaded. the coarsest level is written last, so a cache is complete once it exists
+            tmp_file = cache_dir / f"{key}_L{idx}.npy.tmp"
+            with open(tmp_file, "wb") as f:
+                np.save(f, level)
+            tmp_file.replace(cache_dir / f"{key}_L{idx}.npy")
+        return cls([np.load(cache_dir / f"{key}_L{idx}.npy", mmap_mode='r') for idx in range(len(pyramid.levels))])
+
+    @classmethod
+    def load_cached(cls, cache_dir: pathlib.Path, key: str) -> Union["ImagePyramid", None]:
+        """ memory-map the cached levels of an image, or None if there's no complete pyramid for it - levels
+        left out by a crash mid-write mean the chain of halvings doesn't reach `COARSE_SIZE` """
+        levels = []
+        while (cache_dir / f"{key}_L{len(levels)}.npy").exists():
+            try:
+                level = np.load(cache_dir / f"{key}_L{len(levels)}.npy", mmap_mode='r')
+            except (OSError, ValueError):
+                return None
+            if levels and level.shape[:2] != (levels[-1].shape[0] // 2, levels[-1].shape[1] // 2):
+                return None
+            levels.append(level)
+            if max(level.shape[:2]) <= COARSE_SIZE:
+                return cls(levels)
+        return None
+
+    def level_for(self, image_px_per_screen_px: float) -> int:
+        """ coarsest level that still has at least one pixel per screen pixel at the current zoom """
+        if image_px_per_screen_px <= 1:
+            return 0
+        return min(int(math.log2(image_px_per_screen_px)), len(self.levels) - 1)
+
+    def region(self, level: int, x0: float, y0: float, x1: float, y1: float) -> Tuple[np.ndarray, QtCore.QRectF]:
+        """ pixels of a level covering a rectangle in full-resolution coordinates, expanded to whole tiles
+
+        Returns:
+            np.ndarray: pixels read from the level
+            QtCore.QRectF: where they go, in full-resolution coordinates
+        """
+        scale = self.scale(level)
+        height, width = self.levels[level].shape[:2]
+        c0 = max(0, int(x0 / scale) // TILE_SIZE * TILE_SIZE)
+        r0 = max(0, int(y0 / scale) // TILE_SIZE * TILE_SIZE)
+        c1 = min(width, math.ceil(x1 / scale / TILE_SIZE) * TILE_SIZE)
+        r1 = min(height, math.ceil(y1 / scale / TILE_SIZE) * TILE_SIZE)
+        pixels = np.ascontiguousarray(self.levels[level][r0:r1, c0:c1])
+        return pixels, QtCore.QRectF(c0 * scale, r0 * scale, (c1 - c0) * scale, (r1 - r0) * scale)
+
+
+def session_images(folder: Union[str, pathlib.Path]) -> List[pathlib.Path]:
+    """ image files in a folder, sorted by name """
+    return sorted(f for f in pathlib.Path(folder).iterdir() if f.suffix.lower() in IMAGE_SUFFIXES)
+
+
+class ImageCache:
+    """ byte-bounded LRU of image pyramids
+
+    each photo is decoded once into memory-mapped .npy levels (see `ImagePyramid.load`); pyramids in this cache
+    also hold their coarsest level in RAM, so switching back to a recent image needs no disk or network reads.
+    least recently used pyramids are dropped once their total exceeds `max_bytes`. safe to use from several
+    threads: an image requested while it's already loading waits for that load rather than starting another
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES, cache_dir: pathlib.Path = IMAGE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.pyramids = OrderedDict() # {cache key: ImagePyramid}, least recently used first
+        self.nbytes = 0
+        self.loading = {}             # {cache key: Future} for loads in progress
+        self.lock = threading.Lock()
+
+    def __contains__(self, image_path) -> bool:
+        with self.lock:
+            return cache_key(image_path) in self.pyramids
+
+    def get(self, image_path: Union[str, pathlib.Path]) -> ImagePyramid:
+        key = cache_key(image_path)
+        with self.lock:
+            if key in self.pyramids:
+                self.pyramids.move_to_end(key)
+                return self.pyramids[key]
+            future = self.loading.get(key)
+            if future is None:
+                future = self.loading[key] = Future()
+                loader = True
+            else:
+                loader = False
+        if not loader:
+            return future.result()
+
+        try:
+            pyramid = ImagePyramid.load(image_path, self.cache_dir, key)
+            pyramid.levels[-1] = np.array(pyramid.levels[-1]) # read into RAM
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.loading[key]
+            self.pyramids[key] = pyramid
+            self.nbytes += pyramid.nbytes
+            while self.nbytes > self.max_bytes and len(self.pyramids) > 1:
+                _, evicted = self.pyramids.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        future.set_result(pyramid)
+        return pyramid
+
+
+class ImagePyramidLoader(QtCore.QObject):
+    """ loads pyramids on worker threads, so opening a new photo never blocks the viewer, and prefetches the
+    photos either side of it in the same folder so flipping between them is near-instant """
+
+    pyramidReady = QtCore.Signal(str, object) # image path, ImagePyramid
+
+    def __init__(self, cache: ImageCache = None, max_workers: int = 2, parent=None):
+        super().__init__(parent)
+        self.cache = cache or ImageCache()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_future = None
+        self.folder_images = {} # {folder: (mtime_ns, [image paths])}, only used by the prefetch worker
+        self.latest = None
+
+    def load(self, image_path: Union[str, pathlib.Path], prefetch: int = PREFETCH_NEIGHBOURS):
+        self.latest = str(image_path)
+        future = self.pool.submit(self.cache.get, image_path)
+        future.add_done_callback(lambda future: self.deliver(str(image_path), future))
+
+        # neighbours of the previous image are no longer wanted
+        if self.prefetch_future is not None:
+            self.prefetch_future.cancel()
+        self.prefetch_future = self.prefetch_pool.submit(self.prefetchNeighbours, str(image_path), prefetch)
+
+    def neighbours(self, image_path: Union[str, pathlib.Path], n: int) -> List[pathlib.Path]:
+        """ up to n images either side of an image in its folder, nearest first - lists the folder, so runs on
+        the prefetch worker """
+        image_path = pathlib.Path(image_path)
+        if n <= 0:
+            return []
+        folder = str(image_path.parent)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            listed_mtime, images = self.folder_images.get(folder, (None, []))
+            if mtime != listed_mtime:
+                # folder not listed yet, or images were added or removed since
+                images = session_images(folder)
+                self.folder_images[folder] = (mtime, images)
+        except OSError:
+            return []
+        try:
+            idx = images.index(image_path)
+        except ValueError:
+            return []
+        nearest = []
+        for offset in range(1, n + 1):
+            nearest += [images[i] for i in (idx + offset, idx - offset) if 0 <= i < len(images)]
+        return nearest
+
+    def prefetchNeighbours(self, image_path: str, n: int):
+        for neighbour in self.neighbours(image_path, n):
+            if image_path != self.latest:
+                return # another image was opened since
+            try:
+                self.cache.get(neighbour)
+            except OSError:
+                pass # not an error until someone opens it
+
+    def deliver(self, image_path, future):
+        try:
+            pyramid = future.result()
+        except Exception as e: # raised on a worker thread, so nowhere else to report it
+            print(f"could not load {image_path=}: {e!r}") # todo logging
+            return
+        if image_path != self.latest:
+            return # another image was opened since
+        self.pyramidReady.emit(image_path, pyramid) # delivered to slots on the GUI thread
+
+
+class TiledImageLayer(QtCore.QObject):
+    """ shows an ImagePyramid in a pg.ImageView: the coarsest level fills the ImageView's own image item,
+    scaled up to full-resolution coordinates, and a second image item on top shows the visible region at the
+    level the current zoom needs - updated shortly after the view stops moving
+    """
+
+    def __init__(self, image_view: pg.ImageView, delay_ms: int = 50, parent=None):
+        super().__init__(parent)
+        self.image_view = image_view
+        self.pyramid = None
+        self.detail = pg.ImageItem()
+        self.detail.setZValue(1) # above the coarse image, below probe markers
+        self.detail.hide()
+        image_view.getView().addItem(self.detail)
+        self.timer = QtCore.QTimer(self, singleShot=True, interval=delay_ms)
+        self.timer.timeout.connect(self.updateDetail)
+        image_view.getView().sigRangeChanged.connect(lambda *args: self.timer.start())
+
+    def setPyramid(self, pyramid: ImagePyramid):
+        self.pyramid = pyramid
+        self.detail.hide()
+        scale = pyramid.scale(len(pyramid.levels) - 1)
+        self.image_view.setImage(np.asarray(pyramid.coarsest), transform=QtGui.QTransform.fromScale(scale, scale))
+        self.timer.start()
+
+    def updateDetail(self):
+        if self.pyramid is None:
+            return
+        view = self.image_view.getView()
+        px_width, px_height = view.viewPixelSize()
+        level = self.pyramid.level_for(min(px_width, px_height))
+        if level == len(self.pyramid.levels) - 1:
+            self.detail.hide()
+            return
+        rect = view.viewRect()
+        pixels, region = self.pyramid.region(level, rect.left(), rect.top(), rect.right(), rect.bottom())
+        if pixels.size == 0:
+            self.detail.hide()
+            return
+        self.detail.setImage(pixels, levels=self.image_view.getImageItem().getLevels())
+        self.detail.setRect(region)
+        self.detail.show()
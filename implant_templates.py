@@ -0,0 +1,198 @@
+""" implant templates: where the holes are on each implant, which brain area each targets, and a template
+image of the implant that insertion photos can be aligned to (see registration.py)
+
+templates are stored with each implant in implant_info.json:
+    "template": {
+        "image": "templates/TS-4.png",   # relative to implant_info.json, or null
+        "holes": [{"id": 1, "x": 512.0, "y": 230.5, "area": "VISp"}, ...]   # x, y in template image pixels
+    }
+
+a marker snaps to the nearest hole through a grid index: each grid cell stores the few holes that could be
+nearest to any point in it, so thousands of markers are assigned holes with one vectorized lookup
+"""
+import json
+import pathlib
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import numpy as np
+
+from probe_history import NO_HOLE
+from utils import IMPLANT_INFO_FILE, file_signature
+
+
+class HoleIndex:
+    """ uniform grid over a set of hole positions, for nearest-hole queries
+
+    for every cell, only holes whose distance to the cell could be the smallest are kept as candidates (hole's
+    nearest distance to the cell <= smallest farthest distance of any hole to the cell), so a query checks a
+    handful of holes rather than all of them. points outside the grid fall back to checking every hole
+    """
+
+    def __init__(self, hole_ids: Iterable[int], positions: np.ndarray, cells_per_hole: int = 16):
+        self.hole_ids = np.asarray(hole_ids, dtype=int)
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        n = len(self.positions)
+        if n == 0:
+            self.origin, self.cell_size, self.shape = np.zeros(2), np.ones(2), (0, 0)
+            self.candidates = np.zeros((0, 0), dtype=int)
+            return
+
+        lo, hi = self.positions.min(axis=0), self.positions.max(axis=0)
+        margin = max(np.ptp(self.positions, axis=0).max(), 1) * 0.25
+        self.origin = lo - margin
+        extent = hi + margin - self.origin
+        n_cells = max(1, int(np.sqrt(cells_per_hole * n)))
+        self.shape = (n_cells, n_cells) # rows (y), columns (x)
+        self.cell_size = extent / n_cells
+
+        # distances from every cell rectangle to every hole: (cells, holes)
+        cols, rows = np.meshgrid(np.arange(n_cells), np.arange(n_cells))
+        cell_lo = self.origin + np.column_stack((cols.ravel(), rows.ravel())) * self.cell_size
+        cell_hi = cell_lo + self.cell_size
+        p = self.positions[None]
+        nearest = np.linalg.norm(np.maximum(0, np.maximum(cell_lo[:, None] - p, p - cell_hi[:, None])), axis=2)
+        farthest = np.linalg.norm(np.maximum(np.abs(cell_lo[:, None] - p), np.abs(cell_hi[:, None] - p)), axis=2)
+        is_candidate = nearest <= farthest.min(axis=1, keepdims=True)
+
+        # candidates for each cell as hole positions in the list, padded with -1 to the largest count
+        width = is_candidate.sum(axis=1).max()
+        order = np.argsort(~is_candidate, axis=1, kind="stable")[:, :width]
+        self.candidates = np.where(np.take_along_axis(is_candidate, order, axis=1), order, -1)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def nearest(self, points: np.ndarray) -> tuple:
+        """ nearest hole to each point
+
+        Returns:
+            hole_ids (np.ndarray): id of nearest hole, or NO_HOLE if there are no holes
+            distances (np.ndarray): to that hole
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        hole_ids = np.full(len(points), NO_HOLE, dtype=int)
+        distances = np.full(len(points), np.inf)
+        if len(self) == 0 or len(points) == 0:
+            return hole_ids, distances
+
+        cell = np.floor((points - self.origin) / self.cell_size).astype(int)
+        inside = np.all((cell >= 0) & (cell < self.shape[::-1]), axis=1)
+
+        # inside the grid: only the candidates for each point's cell
+        candidates = self.candidates[cell[inside, 1] * self.shape[1] + cell[inside, 0]] # (points, candidates)
+        d = np.linalg.norm(self.positions[candidates] - points[inside, None], axis=2)
+        d[candidates < 0] = np.inf
+        best = np.argmin(d, axis=1)
+        hole_ids[inside] = self.hole_ids[candidates[np.arange(len(best)), best]]
+        distances[inside] = d[np.arange(len(best)), best]
+
+        # outside: every hole
+        if not inside.all():
+            d = np.linalg.norm(self.positions[None] - points[~inside, None], axis=2)
+            best = np.argmin(d, axis=1)
+            hole_ids[~inside] = self.hole_ids[best]
+            distances[~inside] = d[np.arange(len(best)), best]
+        return hole_ids, distances
+
+
+@dataclass
+class ImplantTemplate:
+    """ hole layout of one implant, with a grid index for snapping marker positions to holes """
+    implant: dict                          # implant info dict from implant_info.json (see `get_implant_type`)
+    hole_ids: np.ndarray
+    hole_positions: np.ndarray             # (n, 2) x, y in template image pixels
+    hole_areas: np.ndarray                 # brain area targeted through each hole
+    image_path: pathlib.Path = None
+    hole_index: HoleIndex = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.hole_index = HoleIndex(self.hole_ids, self.hole_positions)
+
+    @classmethod
+    def from_implant(cls, implant: dict, template_dir: pathlib.Path) -> "ImplantTemplate":
+        template = implant.get("template") or {}
+        holes = template.get("holes") or []
+        image = template.get("image")
+        return cls(
+            implant=implant,
+            hole_ids=np.array([hole["id"] for hole in holes], dtype=int),
+            hole_positions=np.array([(hole["x"], hole["y"]) for hole in holes], dtype=float).reshape(-1, 2),
+            hole_areas=np.array([hole.get("area", "") for hole in holes], dtype=object),
+            image_path=pathlib.Path(template_dir) / image if image else None,
+        )
+
+    def snap(self, points: np.ndarray, offset=(0, 0), max_distance: float = None) -> np.ndarray:
+        """ id of the hole nearest to each marker position, or NO_HOLE if none is within `max_distance`
+
+        Args:
+            points (np.ndarray): (n, 2) x, y marker positions
+            offset: x, y shift of the photo the markers are on relative to the template image, eg. from
+                `registration.estimate_shift(template, photo)`
+        """
+        hole_ids, distances = self.hole_index.nearest(np.asarray(points, dtype=float).reshape(-1, 2) - offset)
+        if max_distance is not None:
+            hole_ids[distances > max_distance] = NO_HOLE
+        return hole_ids
+
+    def area(self, hole_ids: Iterable[int]) -> np.ndarray:
+        """ brain area targeted through each hole, "" for NO_HOLE or unknown ids """
+        hole_ids = np.asarray(hole_ids, dtype=int)
+        areas = np.full(hole_ids.shape, "", dtype=object)
+        order = np.argsort(self.hole_ids)
+        found = np.searchsorted(self.hole_ids[order], hole_ids)
+        found = np.clip(found, 0, max(len(order) - 1, 0))
+        if len(order):
+            match = self.hole_ids[order][found] == hole_ids
+            areas[match] = self.hole_areas[order][found[match]]
+        return areas
+
+
+# in-memory templates, {json path: (file signature, {implant type: ImplantTemplate})}
+_implant_templates = {}
+
+
+def get_implant_templates(implant_info_file: pathlib.Path = IMPLANT_INFO_FILE) -> dict:
+    """ {implant type: ImplantTemplate} for every implant in the json file, only rebuilt if the file has changed """
+    signature = file_signature(implant_info_file)
+
+    cached = _implant_templates.get(str(implant_info_file))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with pathlib.Path(implant_info_file).open() as json_file:
+        json_data = json.load(json_file)
+
+    template_dir = pathlib.Path(implant_info_file).parent
+    templates = {
+        implant["type"]: ImplantTemplate.from_implant(implant, template_dir) for implant in json_data["implants"]
+    }
+    _implant_templates[str(implant_info_file)] = (signature, templates)
+    return templates
+
+
+def assign_holes(implant_types: Iterable[str], points: np.ndarray, offsets: np.ndarray = None,
+                 max_distance: float = None) -> np.ndarray:
+    """ hole ids for many stored marker positions at once, eg. a whole cohort from the insertion record store
+
+    Args:
+        implant_types (Iterable[str]): implant type of each row, eg. "TS-4" - unknown types get NO_HOLE
+        points (np.ndarray): (n, 2) marker x, y of each row
+        offsets (np.ndarray): (n, 2) shift of each row's photo relative to its template image, or None
+
+    Returns:
+        np.ndarray: hole id for each row, or NO_HOLE
+    """
+    implant_types = np.asarray(implant_types, dtype=object)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    offsets = np.zeros_like(points) if offsets is None else np.asarray(offsets, dtype=float).reshape(-1, 2)
+    hole_ids = np.full(len(points), NO_HOLE, dtype=int)
+    templates = get_implant_templates()
+    # one batched query per implant type
+    for implant_type in set(implant_types.tolist()):
+        template = templates.get(implant_type)
+        if template is None:
+            continue
+        rows = implant_types == implant_type
+        hole_ids[rows] = template.snap(points[rows] - offsets[rows], max_distance=max_distance)
+    return hole_ids
@@ -0,0 +1,140 @@
+""" persistent store of probe insertion records: for each session, the implant used and for each probe its
+planned hole, the hole actually hit, its marker position on the insertion photo and any notes
+
+records are only ever appended - saving a session again adds a new revision of its rows rather than updating
+them - and reads return the latest revision. rows are indexed by mouse ID and date, so a mouse's full history
+or a whole cohort is one indexed query
+"""
+import pathlib
+import sqlite3
+import threading
+from time import time
+from typing import Iterable, Union
+
+import numpy as np
+
+from probe_history import NO_HOLE
+from session_index import parse_session_name
+
+# local sqlite file (in current working directory)
+INSERTION_RECORDS_DB = pathlib.Path("insertion_records.sqlite")
+
+RECORD_COLUMNS = (
+    "session", "mouse_id", "date", "implant", "probe_idx", "planned_hole", "hit_hole", "x", "y", "notes",
+    "image_path", "saved",
+)
+
+# annotations saved by the viewer beside each insertion photo: <photo stem>_probes.json
+ANNOTATIONS_SUFFIX = "_probes.json"
+
+# row is the latest revision of its (session, probe) - a lookup in the session index per row
+_LATEST = (
+    "rowid = (SELECT MAX(rowid) FROM insertions AS later "
+    "WHERE later.session = insertions.session AND later.probe_idx = insertions.probe_idx)"
+)
+
+
+def annotations_path(image_path: Union[str, pathlib.Path]) -> pathlib.Path:
+    """ annotations are saved beside the insertion photo """
+    image_path = pathlib.Path(image_path)
+    return image_path.with_name(f"{image_path.stem}{ANNOTATIONS_SUFFIX}")
+
+
+class InsertionRecordStore:
+    """ sqlite table of insertion records, one row per probe per saved revision of a session
+
+    safe to append from one thread (eg. autosave) while another reads
+    """
+
+    def __init__(self, db_path: Union[str, pathlib.Path] = INSERTION_RECORDS_DB):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS insertions (
+                    session TEXT, mouse_id INTEGER, date INTEGER, implant TEXT, probe_idx INTEGER,
+                    planned_hole INTEGER, hit_hole INTEGER, x REAL, y REAL, notes TEXT, image_path TEXT,
+                    saved REAL
+                );
+                CREATE INDEX IF NOT EXISTS insertions_mouse_id ON insertions (mouse_id);
+                CREATE INDEX IF NOT EXISTS insertions_date ON insertions (date);
+                CREATE INDEX IF NOT EXISTS insertions_session ON insertions (session, probe_idx);
+            """)
+
+    def append(self, session: str, probe_idx: Iterable[int], positions: np.ndarray = None,
+               planned_holes: Iterable[int] = NO_HOLE, hit_holes: Iterable[int] = NO_HOLE,
+               notes: Iterable[str] = "", implant: str = None, image_path: str = None):
+        """ save a new revision of a session's probes - array arguments have one entry per probe, scalars are
+        used for every probe
+
+        Args:
+            session (str): session folder name <lims>_<mouse>_<date>, which mouse ID and date are taken from
+            probe_idx (Iterable[int]): probe index [0-5] of each row
+            positions (np.ndarray): (n, 2) marker x, y on the insertion photo, or None if not placed
+        """
+        lims_id, mouse_id, date = parse_session_name(session) or (None, None, None)
+        probe_idx = np.atleast_1d(probe_idx).astype(int)
+        n = len(probe_idx)
+        positions = np.full((n, 2), np.nan) if positions is None else np.asarray(positions, dtype=float).reshape(n, 2)
+        planned_holes = np.broadcast_to(planned_holes, n).astype(int)
+        hit_holes = np.broadcast_to(hit_holes, n).astype(int)
+        notes = np.broadcast_to(np.asarray(notes, dtype=object), n)
+        saved = time()
+        rows = (
+            (session, mouse_id, date, implant, int(probe_idx[i]), int(planned_holes[i]), int(hit_holes[i]),
+             *(None if np.isnan(v) else float(v) for v in positions[i]), notes[i], image_path and str(image_path),
+             saved)
+            for i in range(n)
+        )
+        with self.lock, self.db:
+            self.db.executemany(f"INSERT INTO insertions VALUES ({', '.join('?' * len(RECORD_COLUMNS))})", rows)
+
+    def query(self, where: str = "1", params: tuple = ()):
+        """ latest revision of rows matching an sql condition, as a DataFrame with RECORD_COLUMNS """
+        import pandas as pd
+
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {', '.join(RECORD_COLUMNS)} FROM insertions WHERE ({where}) AND {_LATEST} "
+                "ORDER BY date, session, probe_idx",
+                params,
+            ).fetchall()
+        return pd.DataFrame.from_records(rows, columns=RECORD_COLUMNS)
+
+    def session(self, session: str):
+        return self.query("session = ?", (session,))
+
+    def history(self, mouse_id: int):
+        """ every session recorded for a mouse """
+        return self.query("mouse_id = ?", (int(mouse_id),))
+
+    def previous_positions(self, mouse_id: int, before_date: int):
+        """ marker positions from the most recent session of a mouse before a date that has any placed
+
+        Returns:
+            tuple: (image path, probe indices, (n, 2) positions) from the latest photo annotated in that
+                session, or None
+        """
+        records = self.query("mouse_id = ? AND date < ? AND x IS NOT NULL AND image_path IS NOT NULL",
+                             (int(mouse_id), int(before_date)))
+        if records.empty:
+            return None
+        latest = records[records["date"] == records["date"].max()]
+        latest = latest[latest["saved"] == latest["saved"].max()]
+        return (latest["image_path"].iloc[0], latest["probe_idx"].to_numpy(), latest[["x", "y"]].to_numpy())
+
+    def cohort(self, mouse_ids: Iterable[int] = None, start_date: int = None, end_date: int = None):
+        """ sessions for a list of mice and/or a range of dates (yyyymmdd, inclusive) """
+        conditions, params = [], []
+        if mouse_ids is not None:
+            mouse_ids = [int(m) for m in mouse_ids]
+            conditions.append(f"mouse_id IN ({', '.join('?' * len(mouse_ids))})")
+            params += mouse_ids
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(int(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(int(end_date))
+        return self.query(" AND ".join(conditions) or "1", tuple(params))
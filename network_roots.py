@@ -0,0 +1,71 @@
+""" check which network roots are reachable before the browser touches them """
+import os
+import queue
+import threading
+from time import perf_counter
+from typing import Callable, Iterable
+
+from profiling import timer
+
+# seconds to wait for each root to respond
+ROOT_TIMEOUT = 5.0
+
+
+def probe_root(root: str) -> float:
+    """ time taken for a root folder to respond to a stat, raising OSError if it's unreachable """
+    t0 = perf_counter()
+    with timer(f"probe_root {root}"):
+        if not os.path.isdir(root):
+            raise OSError(f"{root} is not an accessible folder")
+    return perf_counter() - t0
+
+
+def probe_roots(roots: Iterable, timeout: float = ROOT_TIMEOUT, on_result: Callable = None) -> dict:
+    """ probe all roots at once, giving up on any that don't respond within `timeout` seconds
+
+    each root is checked on its own daemon thread, so a share that hangs can't hold up the others or stop the
+    program exiting: total time is roughly that of the slowest root that responds
+
+    Args:
+        roots (Iterable): folders to check
+        timeout (float): seconds to wait before marking a root unavailable
+        on_result (Callable): called with (root, seconds to respond or None) as soon as each root is resolved
+
+    Returns:
+        dict: {root (str): seconds taken to respond, or None if unavailable}
+    """
+    roots = [str(root) for root in roots]
+    results = queue.Queue()
+
+    def probe(root):
+        try:
+            results.put((root, probe_root(root)))
+        except OSError:
+            results.put((root, None))
+
+    for root in roots:
+        threading.Thread(target=probe, args=(root,), daemon=True).start()
+
+    responses = dict.fromkeys(roots)
+    pending = set(roots)
+    deadline = perf_counter() + timeout
+    while pending:
+        try:
+            root, elapsed = results.get(timeout=max(0, deadline - perf_counter()))
+        except queue.Empty:
+            break
+        pending.discard(root)
+        responses[root] = elapsed
+        if elapsed is None:
+            print(f"{root} is unreachable - marked unavailable") # todo logging
+        else:
+            print(f"{root} responded in {elapsed:.2f} s") # todo logging
+        if on_result is not None:
+            on_result(root, elapsed)
+
+    for root in pending:
+        print(f"{root} did not respond within {timeout} s - marked unavailable") # todo logging
+        if on_result is not None:
+            on_result(root, None)
+
+    return responses
@@ -1,130 +1,25 @@
-from typing import List, Tuple, Union
+import json
+import pathlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
 
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtWidgets
 
-app = pg.mkQApp("From InfiniteLine Example")
-# win = pg.GraphicsLayoutWidget(show=True, title="Plotting items examples")
-
-# Interpret image data as row-major instead of col-major
-pg.setConfigOptions(imageAxisOrder='row-major')
-
-# Enable antialiasing for prettier plots
-pg.setConfigOptions(antialias=True)
-
-# Create window with ImageView widget
-mw = QtWidgets.QMainWindow()
-mw.resize(200, 200)
-cw = QtWidgets.QWidget()
-mw.setCentralWidget(cw)
-l = QtWidgets.QVBoxLayout()
-cw.setLayout(l)
-
-imv = pg.ImageView()
-l.addWidget(imv)
-
-label = QtWidgets.QLabel("Probe notes")
-l.addWidget(label)
-
-g = QtWidgets.QGridLayout()
-l.addLayout(g)
-
-data = np.random.normal(size=(200, 200))
-imv.setImage(data)
-imv.ui.histogram.hide()
-imv.ui.roiBtn.hide()
-imv.ui.menuBtn.hide()
-
-# TODO fix dangling pointer after remove
-# QGraphicsScene::removeItem: item 0x1f0c7168720's scene (0x0) is different from this scene (0x1f0bfa7a490)
-
-
-def probe_idx2chr_list(probe_idx: Union[int, List]) -> List:
-    "convert probe index [0-5] to a character [A-F] - this version accepts and returns lists"
-    if probe_idx is int:
-        probe_idx = [probe_idx]
-    if not all([idx in [*range(6)] for idx in probe_idx]):
-        raise ValueError("Probe index must be 0 to 5 (A to F)")
-    start_chr_idx = ord("A".upper()) # 65
-    probe_chr_idx = np.array(start_chr_idx) + probe_idx
-    return [chr(idx) for idx in probe_chr_idx]
-
-
-def probe_idx2chr(probe_idx: int) -> chr:
-    "convert probe index [0-5] to a character [A-F] - this version accepts an int and returns a single chr"
-    if not probe_idx in range(6):
-        raise ValueError("Probe index must be 0 to 5 (A to F)")
-    start_chr_idx = ord("A".upper()) # 65
-    probe_chr_idx = start_chr_idx + probe_idx
-    return chr(probe_chr_idx)
-
-
-def probe_chr2idx(probe_chr: chr) -> int:
-    "convert probe index [0-5] to a character [A-F] - this version accepts an int and returns a single chr"
-    if not probe_chr in probe_idx2chr_list(range(6)):
-        raise ValueError("Probe index must be A to F (0 to 5)")
-    start_chr_idx = ord("A".upper()) # 65
-    probe_idx = ord(probe_chr) - start_chr_idx
-    return probe_idx
-
-
-def add_probe_marker(probe_idx: int = None):
-    if probe_idx is None or bool:
-        probe_idx = mw.sender().probe_idx
-    if probe_marker_list[probe_idx] is None:
-        probe_marker_list[probe_idx] = pg.TargetItem(symbol="x")
-        probe_marker_list[probe_idx].probe_idx = probe_idx
-        probe_marker_list[probe_idx].probe_label = probe_idx2chr(probe_idx)
-        set_initial_probe_marker_properties(probe_marker_list[probe_idx])
-        imv.addItem(probe_marker_list[probe_idx])
-        # update_probe_button(probe_button_list[probe_idx])
-    else:
-        probe_marker_list[probe_idx].setVisible(True)
-
-
-def remove_probe_marker(probe_idx: int = None):
-    if probe_idx is None or bool:
-        probe_idx = mw.sender().probe_idx
-    # imv.removeItem(probe_marker_list[probe_idx])
-    probe_marker_list[probe_idx].setVisible(False)
-    # probe_marker_list[probe_idx] = None
-    # update_probe_button(probe_button_list[probe_idx])
-
-    # refactor https: // python.hotexamples.com/examples/pyqtgraph/PlotWidget/removeItem/python-plotwidget-removeitem-method-examples.html
-
-
-def update_on_probe_button_toggle(probe_button):
-    if probe_button is None or bool:
-        probe_idx = mw.sender().probe_idx
-        probe_button = probe_button_list[probe_idx]
-    if not probe_button.isChecked():
-        add_probe_marker(probe_button.probe_idx)
-        probe_button.setText(f"Remove {probe_button.probe_label} marker")
-        # probe_button.clicked.connect(
-        #     remove_probe_marker)
-    elif probe_button.isChecked():
-        remove_probe_marker(probe_button.probe_idx)
-        probe_button.setText(f"Add {probe_button.probe_label} marker")
-        # probe_button.clicked.connect(
-        #     add_probe_marker)
-
-
-def set_initial_probe_marker_properties(probe_marker):
-    probe_marker.setPos(
-        get_probe_marker_start_pos_on_img(
-            [imv.getImageItem().width(), imv.getImageItem().height()], probe_marker.probe_idx))
-    # probe_marker.size = 10
-    # probe_marker.setSymbol("x")
-    probe_marker.setPen("#FF4444")
-    probe_marker.setBrush("#FF4444", opacity=.5)
-    probe_marker.setHoverBrush("#FFFFFF", opacity=0)
-    probe_marker.setLabel(probe_marker.probe_label, {
-        "anchor": QtCore.QPointF(0.5, 0.5),
-        "offset": QtCore.QPointF(0, -10),
-        "color": "#FF4444",
-        "rotateAxis": (0, 0)
-    })
+import utils
+from autosave import Autosaver, write_json_atomic
+from image_pyramid import ImagePyramidLoader, TiledImageLayer, read_image
+from implant_templates import assign_holes, get_implant_templates
+from insertion_records import InsertionRecordStore, annotations_path
+from probe_history import NO_HOLE, ProbePositionHistory, show_history
+from probe_labels import PROBE_LABELS
+from probe_markers import ProbeMarkerLayer
+from profiling import timed
+from profiling_dock import TimingDock
+from registration import MIN_CONFIDENCE, carry_over, estimate_shift
+from session_index import parse_session_name, session_reg_exp
 
 
 def get_probe_marker_start_pos_on_img(parent_img_dim, probe_idx) -> Tuple:
@@ -136,32 +31,310 @@ def get_probe_marker_start_pos_on_img(parent_img_dim, probe_idx) -> Tuple:
     return (x, y)
 
 
-probe_notes_list = []
-probe_button_list = []
-probe_marker_list = [None] * 6
-for probe_idx, probe_label in enumerate(["A", "B", "C", "D", "E", "F"]):
-
-    probe_notes_list.append(QtWidgets.QLineEdit(placeholderText=f"Notes on probe {probe_label}"))
-    probe_notes_list[probe_idx].probe_idx = probe_idx
-    probe_notes_list[probe_idx].probe_label = probe_label
-
-    g.addWidget(probe_notes_list[probe_idx], probe_idx, 0)
-
-    probe_button_list.append(QtWidgets.QPushButton())
-    probe_button_list[probe_idx].probe_idx = probe_idx
-    probe_button_list[probe_idx].probe_label = probe_label
-    probe_button_list[probe_idx].setCheckable(True)
-    # probe_button_list[probe_idx].isChecked(False)
-    probe_button_list[probe_idx].toggled.connect(update_on_probe_button_toggle)
-
-    g.addWidget(probe_button_list[probe_idx], probe_idx, 1)
-
-mw.show()
+class ProbeViewer(QtWidgets.QMainWindow):
+    """ insertion photo with a draggable marker and notes for each probe """
+
+    markersRegistered = QtCore.Signal(str, object, object) # image path, probe indices, positions
+    historyLoaded = QtCore.Signal(str, object) # image path, ProbePositionHistory
+
+    def __init__(self, insertion_records: InsertionRecordStore = None, profile: bool = False):
+        super().__init__()
+
+        # Interpret image data as row-major instead of col-major
+        pg.setConfigOptions(imageAxisOrder='row-major')
+
+        # Enable antialiasing for prettier plots
+        pg.setConfigOptions(antialias=True)
+
+        self.resize(200, 200)
+        cw = QtWidgets.QWidget()
+        self.setCentralWidget(cw)
+        l = QtWidgets.QVBoxLayout()
+        cw.setLayout(l)
+
+        self.imv = imv = pg.ImageView()
+        imv.setImage = timed("imv.setImage")(imv.setImage) # also times images set by the tiled image layer
+        l.addWidget(imv)
+
+        label = QtWidgets.QLabel("Probe notes")
+        l.addWidget(label)
+
+        g = QtWidgets.QGridLayout()
+        l.addLayout(g)
+
+        data = np.random.normal(size=(200, 200))
+        imv.setImage(data)
+        imv.ui.histogram.hide()
+        imv.ui.roiBtn.hide()
+        imv.ui.menuBtn.hide()
+
+        # large insertion photos: coarse level shown immediately, finer tiles loaded as the view zooms in
+        self.tiled_image = TiledImageLayer(imv)
+        self.pyramid_loader = ImagePyramidLoader()
+        self.pyramid_loader.pyramidReady.connect(lambda image_path, pyramid: self.tiled_image.setPyramid(pyramid))
+        self.current_image = None
+
+        # markers on a new photo start where they were on the mouse's last annotated photo, aligned to this one
+        self.registration_pool = ThreadPoolExecutor(max_workers=1)
+        self.pyramid_loader.pyramidReady.connect(self.carry_over_markers)
+        self.markersRegistered.connect(self.set_registered_markers)
+
+        self.probe_notes_list = []
+        self.probe_button_list = []
+        # one batched, draggable layer for the markers of all 6 probes: row = probe index
+        self.probe_markers = ProbeMarkerLayer(movable=True)
+        self.probe_markers.setZValue(10)  # above the image and its high-resolution tiles
+        self.probe_markers.setMarkers(np.zeros((6, 2)), range(6), visible=False)
+        imv.addItem(self.probe_markers)
+        self.probe_marker_placed = [False] * 6
+
+        # positions from previous days, drawn as one overlay beneath today's markers
+        self.probe_history = ProbePositionHistory()
+        self.history_markers = ProbeMarkerLayer()
+        self.history_markers.setZValue(5)
+        imv.addItem(self.history_markers)
+        self.historyLoaded.connect(self.set_history)
+
+        self.insertion_records = insertion_records or InsertionRecordStore()
+        # {image path: (implant type, offset of the photo from its template)}, for hole assignment
+        self.hole_templates = {} # only used by the autosave worker
+        self.autosaver = Autosaver(self.annotation_snapshot, self.save_annotations, parent=self)
+        self.probe_markers.sigMarkerMoved.connect(self.autosaver.markDirty)
+
+        for probe_idx, probe_label in enumerate(PROBE_LABELS):
+
+            self.probe_notes_list.append(QtWidgets.QLineEdit(placeholderText=f"Notes on probe {probe_label}"))
+            self.probe_notes_list[probe_idx].probe_idx = probe_idx
+            self.probe_notes_list[probe_idx].probe_label = probe_label
+            self.probe_notes_list[probe_idx].textChanged.connect(self.autosaver.markDirty)
+
+            g.addWidget(self.probe_notes_list[probe_idx], probe_idx, 0)
+
+            self.probe_button_list.append(QtWidgets.QPushButton())
+            self.probe_button_list[probe_idx].probe_idx = probe_idx
+            self.probe_button_list[probe_idx].probe_label = probe_label
+            self.probe_button_list[probe_idx].setCheckable(True)
+            # probe_button_list[probe_idx].isChecked(False)
+            self.probe_button_list[probe_idx].toggled.connect(self.update_on_probe_button_toggle)
+            self.probe_button_list[probe_idx].toggled.connect(self.autosaver.markDirty)
+
+            g.addWidget(self.probe_button_list[probe_idx], probe_idx, 1)
+
+        if profile:
+            self.addDockWidget(QtCore.Qt.RightDockWidgetArea, TimingDock(self))
+
+    def open_image(self, image_path):
+        "load an insertion photo into the viewer in the background, and prefetch the photos either side of it"
+        self.autosaver.flush() # unsaved changes belong to the previous image
+        self.current_image = pathlib.Path(image_path)
+        self.load_annotations(annotations_path(self.current_image))
+        self.set_history(str(self.current_image), ProbePositionHistory())
+        self.registration_pool.submit(self.load_history, str(self.current_image))
+        self.pyramid_loader.load(image_path)
+
+    def load_annotations(self, path: pathlib.Path):
+        "show the markers and notes saved for the current image, or none if it hasn't been annotated yet"
+        annotations = {}
+        if path.exists():
+            try:
+                with open(path) as f:
+                    annotations = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"could not load annotations {path}: {e!r}") # todo logging
+        placed = np.array(annotations.get("placed", [False] * 6), dtype=bool)
+        positions = np.array(annotations.get("positions", np.zeros((6, 2))), dtype=float).reshape(6, 2)
+        notes = annotations.get("notes", [""] * 6)
+
+        # loading isn't an edit, so mustn't mark the annotations as changed
+        self.probe_markers.setMarkers(positions, range(6), visible=placed)
+        self.probe_marker_placed = placed.tolist()
+        for probe_idx, probe_label in enumerate(PROBE_LABELS):
+            notes_edit, button = self.probe_notes_list[probe_idx], self.probe_button_list[probe_idx]
+            notes_edit.blockSignals(True)
+            notes_edit.setText(notes[probe_idx])
+            notes_edit.blockSignals(False)
+            button.blockSignals(True)
+            button.setChecked(False)
+            button.setText(f"Remove {probe_label} marker" if placed[probe_idx] else "")
+            button.blockSignals(False)
+
+    def carry_over_markers(self, image_path: str, pyramid):
+        "look for markers to carry over to a photo that hasn't been annotated yet"
+        if annotations_path(image_path).exists():
+            return
+        session = parse_session_name(str(image_path))
+        if session is not None:
+            self.registration_pool.submit(self.register_markers, image_path, pyramid, *session[1:])
+
+    @timed()
+    def register_markers(self, image_path: str, pyramid, mouse_id: int, date: int):
+        "align the mouse's last annotated photo to this one and move its markers across - runs on a worker"
+        previous = self.insertion_records.previous_positions(mouse_id, date)
+        if previous is None:
+            return
+        reference_path, probe_idx, positions = previous
+        try:
+            reference = self.pyramid_loader.cache.get(reference_path)
+        except OSError as e:
+            print(f"could not load {reference_path=} to carry markers over: {e!r}") # todo logging
+            return
+        positions = carry_over(
+            reference.coarsest, positions, pyramid.coarsest,
+            reference.scale(len(reference.levels) - 1), pyramid.scale(len(pyramid.levels) - 1),
+        )
+        if positions is None:
+            print(f"could not align {image_path} to {reference_path} - markers not carried over") # todo logging
+            return
+        self.markersRegistered.emit(image_path, probe_idx, positions) # delivered to slots on the GUI thread
+
+    def set_registered_markers(self, image_path: str, probe_idx: np.ndarray, positions: np.ndarray):
+        "use carried-over positions as the starting positions of the markers, instead of the default hexagon"
+        if image_path != str(self.current_image):
+            return # another image was opened since
+        self.probe_markers.moveMarkers(probe_idx, positions)
+        for idx in probe_idx:
+            self.probe_marker_placed[idx] = True
+
+    def get_image_size(self) -> Tuple:
+        "width, height of the displayed image in view coordinates (full-resolution pixels, even if scaled)"
+        image_item = self.imv.getImageItem()
+        rect = image_item.mapRectToParent(image_item.boundingRect())
+        return (rect.width(), rect.height())
+
+    @timed()
+    def add_probe_marker(self, probe_idx: int = None):
+        if probe_idx is None or isinstance(probe_idx, bool):
+            probe_idx = self.sender().probe_idx
+        if not self.probe_marker_placed[probe_idx]:
+            self.set_initial_probe_marker_properties(probe_idx)
+            self.probe_marker_placed[probe_idx] = True
+        self.probe_markers.setMarkersVisible(probe_idx, True)
+
+    def remove_probe_marker(self, probe_idx: int = None):
+        if probe_idx is None or isinstance(probe_idx, bool):
+            probe_idx = self.sender().probe_idx
+        # markers are only hidden, never removed from the scene, so their positions are kept
+        self.probe_markers.setMarkersVisible(probe_idx, False)
+
+    def update_on_probe_button_toggle(self, probe_button):
+        if probe_button is None or isinstance(probe_button, bool):
+            probe_idx = self.sender().probe_idx
+            probe_button = self.probe_button_list[probe_idx]
+        if not probe_button.isChecked():
+            self.add_probe_marker(probe_button.probe_idx)
+            probe_button.setText(f"Remove {probe_button.probe_label} marker")
+            # probe_button.clicked.connect(
+            #     remove_probe_marker)
+        elif probe_button.isChecked():
+            self.remove_probe_marker(probe_button.probe_idx)
+            probe_button.setText(f"Add {probe_button.probe_label} marker")
+            # probe_button.clicked.connect(
+            #     add_probe_marker)
+
+    @timed()
+    def set_initial_probe_marker_properties(self, probe_idx):
+        # pen, brush and label are shared by the whole marker layer: only the position is per-marker
+        self.probe_markers.moveMarkers(probe_idx, get_probe_marker_start_pos_on_img(self.get_image_size(), probe_idx))
+
+    def load_history(self, image_path: str):
+        "positions recorded for the mouse on the days before this photo's session - runs on a worker"
+        session = parse_session_name(image_path)
+        if session is None:
+            return
+        _, mouse_id, date = session
+        records = self.insertion_records.history(mouse_id)
+        records = records[(records["date"] < date) & records["x"].notna()]
+        history = ProbePositionHistory()
+        if not records.empty:
+            dates = records["date"].to_numpy()
+            # recording day 1 is the mouse's first recorded session
+            history.add(np.searchsorted(np.unique(dates), dates) + 1, records["probe_idx"].to_numpy(),
+                        records["x"].to_numpy(), records["y"].to_numpy(), records["hit_hole"].to_numpy())
+        self.historyLoaded.emit(image_path, history) # delivered to slots on the GUI thread
+
+    def set_history(self, image_path: str, history: ProbePositionHistory):
+        "draw the positions from previous days as one overlay, colored by day"
+        if image_path != str(self.current_image):
+            return # another image was opened since
+        self.probe_history = history
+        show_history(self.history_markers, history)
+
+    def annotation_snapshot(self) -> dict:
+        "copy of the current markers and notes, for autosave - runs on the GUI thread, so only copies"
+        if self.current_image is None:
+            return None
+        match = session_reg_exp.search(str(self.current_image))
+        return {
+            "session": match.group(0) if match else None,
+            "image_path": str(self.current_image),
+            "probe_idx": self.probe_markers.probe_idx.tolist(),
+            "placed": self.probe_markers.visible.tolist(),
+            "positions": self.probe_markers.positions.tolist(),
+            "notes": [notes.text() for notes in self.probe_notes_list],
+        }
+
+    def hole_template(self, image_path: str) -> Tuple:
+        """ implant type of a photo's mouse, and the photo's offset from that implant's template image for
+        snapping markers to holes - either is None if not known. runs on the autosave worker: only a found
+        offset is kept, so a photo whose implant or alignment isn't known yet is tried again on the next save """
+        if image_path in self.hole_templates:
+            return self.hole_templates[image_path]
+        session = parse_session_name(image_path)
+        implant = utils.get_implant_type(session[1]) if session is not None else None
+        implant_type = implant["type"] if implant is not None else None
+        template = get_implant_templates().get(implant_type)
+        offset = None
+        if template is None or len(template.hole_index) == 0:
+            pass
+        elif template.image_path is None:
+            offset = (0.0, 0.0) # no template image: holes are in photo pixels
+        else:
+            try:
+                pyramid = self.pyramid_loader.cache.get(image_path)
+                shift = estimate_shift(read_image(template.image_path), pyramid.coarsest, 1,
+                                       pyramid.scale(len(pyramid.levels) - 1))
+            except OSError as e:
+                print(f"could not align {image_path} to implant template: {e!r}") # todo logging
+                shift = None
+            if shift is not None and shift[2] >= MIN_CONFIDENCE:
+                offset = shift[:2]
+            else:
+                print(f"could not align {image_path} to {template.image_path} - holes not assigned") # todo logging
+        if offset is not None:
+            self.hole_templates[image_path] = (implant_type, offset)
+        return (implant_type, offset)
+
+    def save_annotations(self, snapshot: dict):
+        "write a snapshot beside its image and to the insertion record store - runs on the autosave worker"
+        placed = np.array(snapshot["placed"])
+        positions = np.array(snapshot["positions"])
+        hit_holes = np.full(len(placed), NO_HOLE)
+        implant_type, offset = self.hole_template(snapshot["image_path"])
+        if offset is not None:
+            hit_holes[placed] = assign_holes([implant_type] * placed.sum(), positions[placed],
+                                             np.broadcast_to(offset, (placed.sum(), 2)))
+        snapshot = {**snapshot, "hit_holes": hit_holes.tolist()}
+        write_json_atomic(annotations_path(pathlib.Path(snapshot["image_path"])), snapshot)
+        if snapshot["session"] is not None:
+            positions[~placed] = np.nan
+            self.insertion_records.append(snapshot["session"], snapshot["probe_idx"], positions, hit_holes=hit_holes,
+                                          notes=snapshot["notes"], implant=implant_type,
+                                          image_path=snapshot["image_path"])
+
+
+def main():
+    app = pg.mkQApp("From InfiniteLine Example")
+
+    # it's required to save a reference to the window: if it goes out of scope, it will be destroyed
+    # --profile: show a table of hot-path timings
+    args = [arg for arg in sys.argv[1:] if arg != "--profile"]
+    mw = ProbeViewer(profile="--profile" in sys.argv)
+    app.aboutToQuit.connect(mw.autosaver.close)
+    mw.show()
+    if args:
+        mw.open_image(args[0])
+    pg.exec()
 
-# Create a plot with some random data
-# p1 = win.addPlot(title="Plot Items example",
-#                  y=np.random.normal(size=100, scale=10), pen=0.5)
-# p1.setYRange(-40, 40)
 
 if __name__ == '__main__':
-    pg.exec()
+    main()
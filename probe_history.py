@@ -0,0 +1,118 @@
+""" probe positions across recording days, for reviewing a whole week of insertions in one overlay
+
+every marker ever placed is one row of a structured numpy array, so questions like "all B positions across
+days" or "which insertions missed their planned hole" are single vectorized selections, not loops over widgets
+"""
+from typing import TYPE_CHECKING, Iterable, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from probe_markers import ProbeMarkerLayer
+
+NO_HOLE = -1 # hole not known / not assigned
+
+POSITION_DTYPE = np.dtype([
+    ("day", np.int16),       # recording day, 1 = first day
+    ("probe_idx", np.int8),  # [0-5] = [A-F]
+    ("x", np.float32),       # position on image
+    ("y", np.float32),
+    ("hole", np.int16),      # implant hole hit, or NO_HOLE
+])
+
+
+class ProbePositionHistory:
+    """ append-only table of probe positions, stored in a growable structured array """
+
+    def __init__(self, records: np.ndarray = None):
+        records = np.zeros(0, dtype=POSITION_DTYPE) if records is None else np.asarray(records, dtype=POSITION_DTYPE)
+        self._records = records.copy()
+        self._size = len(records)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def records(self) -> np.ndarray:
+        """ all rows so far - a view, so treat as read-only """
+        return self._records[:self._size]
+
+    def extend(self, records: np.ndarray):
+        records = np.asarray(records, dtype=POSITION_DTYPE).reshape(-1)
+        needed = self._size + len(records)
+        if needed > len(self._records):
+            # grow geometrically so repeated appends stay cheap
+            grown = np.zeros(max(needed, 2 * len(self._records), 16), dtype=POSITION_DTYPE)
+            grown[:self._size] = self.records
+            self._records = grown
+        self._records[self._size:needed] = records
+        self._size = needed
+
+    def add(self, day: int, probe_idx: Union[int, Iterable[int]], x, y, hole=NO_HOLE):
+        """ add one position, or several at once with array arguments """
+        probe_idx = np.atleast_1d(probe_idx)
+        records = np.zeros(len(probe_idx), dtype=POSITION_DTYPE)
+        records["day"] = day
+        records["probe_idx"] = probe_idx
+        records["x"] = x
+        records["y"] = y
+        records["hole"] = hole
+        self.extend(records)
+
+    def mask(self, day=None, probe_idx=None) -> np.ndarray:
+        """ boolean mask of rows matching a day and/or probe - each may be a single value or a list """
+        mask = np.ones(self._size, dtype=bool)
+        if day is not None:
+            mask &= np.isin(self.records["day"], day)
+        if probe_idx is not None:
+            mask &= np.isin(self.records["probe_idx"], probe_idx)
+        return mask
+
+    def select(self, day=None, probe_idx=None) -> np.ndarray:
+        """ rows matching a day and/or probe, eg. `select(probe_idx=1)` for all B positions across days """
+        return self.records[self.mask(day, probe_idx)]
+
+    @property
+    def days(self) -> np.ndarray:
+        return np.unique(self.records["day"])
+
+    def positions(self, records: np.ndarray = None) -> np.ndarray:
+        """ (n, 2) x, y of rows (default all) """
+        records = self.records if records is None else records
+        return np.column_stack((records["x"], records["y"]))
+
+    def off_plan(self, planned_holes: np.ndarray) -> np.ndarray:
+        """ boolean mask of rows whose hole differs from the plan
+
+        Args:
+            planned_holes (np.ndarray): (n probes, n days) planned hole for each probe on each day (day 1 in
+                column 0), eg. plan A: {3, 4, 3, 4} is row 0 = [3, 4, 3, 4]
+        """
+        records = self.records
+        planned = np.asarray(planned_holes)[records["probe_idx"], records["day"] - 1]
+        return (records["hole"] != NO_HOLE) & (records["hole"] != planned)
+
+    def drift(self, reference_day: int = 1) -> np.ndarray:
+        """ (n, 2) displacement of each row from the same probe's position on a reference day - NaN for
+        probes with no position on that day. uses the last position recorded for each probe on that day """
+        records = self.records
+        reference = np.full((records["probe_idx"].max(initial=0) + 1, 2), np.nan)
+        on_day = records[records["day"] == reference_day]
+        reference[on_day["probe_idx"]] = self.positions(on_day)
+        return self.positions() - reference[records["probe_idx"]]
+
+
+def day_brushes(days: np.ndarray) -> np.ndarray:
+    """ one brush per row, colored by day - a single brush object is made for each distinct day """
+    import pyqtgraph as pg # only needed for drawing - the history itself can be used without Qt
+
+    unique_days, day_idx = np.unique(days, return_inverse=True)
+    palette = np.empty(len(unique_days), dtype=object)
+    palette[:] = [pg.mkBrush(pg.intColor(i, hues=max(len(unique_days), 1), alpha=160)) for i in range(len(unique_days))]
+    return palette[day_idx]
+
+
+def show_history(layer: "ProbeMarkerLayer", history: ProbePositionHistory, day=None, probe_idx=None):
+    """ draw the selected rows of a history as one batched overlay, colored by day """
+    records = history.select(day, probe_idx)
+    layer.setMarkers(history.positions(records), records["probe_idx"], brushes=day_brushes(records["day"]))
@@ -0,0 +1,47 @@
+""" conversion between probe indices [0-5] and probe labels [A-F]
+
+both directions go through precomputed lookup tables, so a whole array of labels (eg. every probe in a bulk
+export) is converted in one numpy operation. scalars, lists and arrays are accepted; arrays come back with the
+same shape as the input (0-d for a scalar - use `.item()` for a plain int or str)
+"""
+from typing import Iterable, Union
+
+import numpy as np
+
+MAX_PROBES = 6
+
+# index -> label
+PROBE_LABELS = np.array([chr(ord("A") + idx) for idx in range(MAX_PROBES)], dtype="U1")
+
+# character code -> index, for upper and lower case labels: -1 for anything that isn't a probe label
+_CHR2IDX = np.full(256, -1, dtype=np.int8)
+for _idx, _label in enumerate(PROBE_LABELS):
+    _CHR2IDX[ord(_label)] = _CHR2IDX[ord(_label.lower())] = _idx
+
+
+def idx2chr(probe_idx: Union[int, Iterable[int]]) -> np.ndarray:
+    """ convert probe indices [0-5] to labels [A-F] """
+    probe_idx = np.asarray(probe_idx)
+    if probe_idx.dtype.kind not in "iu":
+        if probe_idx.size:
+            raise TypeError(f"Probe index must be an integer, not {probe_idx.dtype}")
+        probe_idx = probe_idx.astype(np.intp)
+    if probe_idx.size and (probe_idx.min() < 0 or probe_idx.max() >= MAX_PROBES):
+        raise ValueError(f"Probe index must be 0 to {MAX_PROBES - 1} (A to {PROBE_LABELS[-1]})")
+    return PROBE_LABELS[probe_idx]
+
+
+def chr2idx(probe_chr: Union[str, Iterable[str]]) -> np.ndarray:
+    """ convert probe labels [A-F], either case, to indices [0-5] """
+    probe_chr = np.asarray(probe_chr)
+    if probe_chr.dtype.kind not in "US":
+        probe_chr = probe_chr.astype(str)
+    if probe_chr.dtype.itemsize > (4 if probe_chr.dtype.kind == "U" else 1):
+        if probe_chr.size and np.any(np.char.str_len(probe_chr) != 1):
+            raise ValueError(f"Probe label must be a single character A to {PROBE_LABELS[-1]}")
+        probe_chr = probe_chr.astype(probe_chr.dtype.kind + "1")
+    codes = probe_chr.view(np.uint32 if probe_chr.dtype.kind == "U" else np.uint8)
+    probe_idx = _CHR2IDX[np.minimum(codes, len(_CHR2IDX) - 1)]
+    if probe_idx.size and probe_idx.min() < 0:
+        raise ValueError(f"Probe label must be A to {PROBE_LABELS[-1]} (0 to {MAX_PROBES - 1})")
+    return probe_idx
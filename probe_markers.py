@@ -0,0 +1,145 @@
+""" batched probe markers for the image viewer (pg_tests.py)
+
+all markers are drawn by a single ScatterPlotItem from numpy arrays of positions, so showing, hiding or
+moving a marker is an array update rather than adding, removing or re-styling a graphics item per probe. each
+marker's symbol is an "x" with its probe letter above it, rendered to a pixmap once per letter/pen/brush by
+pyqtgraph's symbol atlas and re-used for every day and session
+"""
+from typing import Iterable, Union
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.graphicsItems.ScatterPlotItem import Symbols
+from pyqtgraph.Qt import QtCore, QtGui
+
+import probe_labels
+
+# symbol size in screen pixels: the cross takes the middle 40%, the label the top 25%
+MARKER_SIZE = 40
+MARKER_COLOR = "#FF4444"
+
+_label_symbols = {}
+
+
+def label_symbol(label: str) -> QtGui.QPainterPath:
+    """ "x" centred on the marker position, with a probe label above it, scaled to fit the unit square that
+    ScatterPlotItem renders symbols into (y increases downwards) """
+    if label not in _label_symbols:
+        cross = QtGui.QTransform.fromScale(0.4 / 0.85, 0.4 / 0.85).map(Symbols['x'])
+
+        text = QtGui.QPainterPath()
+        text.addText(0, 0, QtGui.QFont("Sans Serif", 10, QtGui.QFont.Bold), label)
+        bounds = text.boundingRect()
+        scale = 0.25 / max(bounds.height(), bounds.width())
+        transform = QtGui.QTransform()
+        transform.translate(0, -0.35)
+        transform.scale(scale, scale)
+        transform.translate(-bounds.center().x(), -bounds.center().y())
+
+        symbol = QtGui.QPainterPath(cross)
+        symbol.addPath(transform.map(text))
+        _label_symbols[label] = symbol
+    return _label_symbols[label]
+
+
+class ProbeMarkerLayer(pg.ScatterPlotItem):
+    """ every probe marker in one item, stored as parallel arrays with one row per marker
+
+    markers can be dragged with the left mouse button if the layer is `movable`
+    """
+
+    sigMarkerMoved = QtCore.Signal(int, float, float)  # marker row, x, y - while dragging
+    sigMarkerMoveFinished = QtCore.Signal(int, float, float)
+
+    def __init__(self, movable: bool = False, size: int = MARKER_SIZE, color=MARKER_COLOR, **kwargs):
+        super().__init__(pxMode=True, size=size, pen=pg.mkPen(color), brush=pg.mkBrush(color), **kwargs)
+        self.movable = movable
+        self.positions = np.zeros((0, 2))
+        self.probe_idx = np.zeros(0, dtype=int)
+        self.visible = np.zeros(0, dtype=bool)
+        self.brushes = np.zeros(0, dtype=object)
+        self.drag_row = None
+        self.drag_offset = None
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def setMarkers(self, positions: np.ndarray, probe_idx: Iterable[int], visible: Union[bool, np.ndarray] = True,
+                   brushes: Iterable = None):
+        """ replace all markers
+
+        Args:
+            positions (np.ndarray): (n, 2) x, y in image coordinates
+            probe_idx (Iterable[int]): probe index [0-5] of each marker, for its label
+            visible (bool | np.ndarray): for all markers, or each one
+            brushes (Iterable): fill for each marker, or None for the layer's color
+        """
+        self.positions = np.array(positions, dtype=float).reshape(-1, 2)
+        self.probe_idx = np.asarray(probe_idx, dtype=int)
+        self.visible = np.broadcast_to(np.asarray(visible, dtype=bool), len(self.positions)).copy()
+        self.brushes = np.empty(len(self.positions), dtype=object)
+        self.brushes[:] = [pg.mkBrush(b) for b in brushes] if brushes is not None else [self.opts['brush']]
+        self.refresh()
+
+    def setMarkersVisible(self, rows, visible: bool = True):
+        self.visible[rows] = visible
+        self.data['visible'][rows] = visible
+        self.updatePositions(rows)
+
+    def moveMarkers(self, rows, positions: np.ndarray):
+        self.positions[rows] = positions
+        self.updatePositions(rows)
+
+    def refresh(self):
+        """ redraw from the arrays - the only place the scatter plot data is replaced. every marker is a spot,
+        row for row, so showing, hiding and moving markers later only changes those rows' spots """
+        self.setData(
+            pos=np.zeros((len(self.positions), 2)),
+            data=np.arange(len(self.positions)),
+            symbol=[label_symbol(label) for label in probe_labels.idx2chr(self.probe_idx)],
+            brush=list(self.brushes),
+        )
+        self.data['visible'] = self.visible
+        self.updatePositions(slice(None))
+
+    def updatePositions(self, rows):
+        """ copy positions of some markers to their spots - hidden markers are moved to NaN, so they don't count
+        towards the layer's bounds """
+        visible = self.visible[rows]
+        self.data['x'][rows] = np.where(visible, self.positions[rows, 0], np.nan)
+        self.data['y'][rows] = np.where(visible, self.positions[rows, 1], np.nan)
+        # as ScatterPlotItem does after changing positions, without restyling every spot
+        self.prepareGeometryChange()
+        self.informViewBoundsChanged()
+        self.bounds = [None, None]
+        self.invalidate()
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        # with every marker hidden all spots are NaN - no bounds, rather than an all-NaN slice warning
+        if not self.visible.any():
+            return (None, None)
+        return super().dataBounds(ax, frac, orthoRange)
+
+    def mouseDragEvent(self, ev):
+        if not self.movable or ev.button() != QtCore.Qt.MouseButton.LeftButton:
+            ev.ignore()
+            return
+        if ev.isStart():
+            points = self.pointsAt(ev.buttonDownPos())
+            if len(points) == 0:
+                ev.ignore()
+                return
+            self.drag_row = int(points[0].data())
+            start = ev.buttonDownPos()
+            self.drag_offset = self.positions[self.drag_row] - (start.x(), start.y())
+        elif self.drag_row is None:
+            ev.ignore()
+            return
+        ev.accept()
+
+        row = self.drag_row
+        self.moveMarkers(row, np.array([ev.pos().x(), ev.pos().y()]) + self.drag_offset)
+        self.sigMarkerMoved.emit(row, *self.positions[row])
+        if ev.isFinish():
+            self.drag_row = None
+            self.sigMarkerMoveFinished.emit(row, *self.positions[row])
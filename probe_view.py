@@ -1,6 +1,11 @@
 import dataclasses
 from dataclasses import dataclass
-from typing import Union
+from typing import Iterable, Union
+
+import numpy as np
+
+import probe_labels
+from probe_history import NO_HOLE
 
 # insertion event
 #   - insertion img, + other imgs pre/post
@@ -32,54 +37,114 @@ class Probe:
     label: str = None
     notes: str = None
     coords: list = None
-    max_probes: int = dataclasses.field(default=6, init=True, repr=False)
+    max_probes: int = dataclasses.field(default=probe_labels.MAX_PROBES, init=True, repr=False)
 
     def __init__(self, init_id):
 
         if isinstance(init_id, str):
-            self.label = init_id
-            self.index = self.chr2idx(init_id)
+            idx = self.chr2idx(init_id)
 
-        elif isinstance(init_id, int):
+        elif isinstance(init_id, (int, np.integer)):
+            idx = int(init_id)
 
-            self.index = init_id
-            self.label = self.idx2chr(init_id)
+        else:
+            raise TypeError(f"{init_id=}: Probe should be initialized with a name [a-f] or number [0-5]")
 
-    @index.setter
-    def index(self, idx):
-        if idx not in range(self.max_probes):
-            raise ValueError(f"{idx=}: Probe index must be in range [0-{self.max_probes-1}]",
-                             f"=> [A-{self.idx2chr(self.max_probes-1)}]")
+        self.validate_index(idx)
         self.index = idx
+        self.label = self.idx2chr(idx)
 
-    @label.setter
-    def label(self, label):
-        self.index = self.chr2idx(str(label)) # validate by assigning to index
-        self.label = label.upper()
+    @classmethod
+    def validate_index(cls, idx):
+        if idx not in range(cls.max_probes):
+            raise ValueError(f"{idx=}: Probe index must be in range [0-{cls.max_probes-1}]",
+                             f"=> [A-{cls.idx2chr(cls.max_probes-1)}]")
 
     @classmethod
     def idx2chr(self, idx=None) -> str:
         """convert probe index [0-5] to a character [A-F]"""
         if idx is None:
             idx = self.index
-        start_idx = ord("A".upper()) # find character index for "A", first in our series
-        return chr(start_idx + idx)  # find our character relative to "A"
+        return probe_labels.idx2chr(idx).item()
 
     @classmethod
     def chr2idx(self, label=None) -> int:
         """convert probe label character [A-F] to an index [0-5]"""
         if label is None:
             label = self.label
-
-        start_idx = ord("A".upper())  # find character index for "A", first in our series
-        this_idx = ord(label.upper()) # find our character index
-        return this_idx - start_idx   # find the number of positions of our character from "A"
+        return probe_labels.chr2idx(label).item()
 
     class nestedtest:
         ...
 
 
-x = [b, c, a] = [Probe(1), Probe("C"), Probe(0)]
+class ProbeSet:
+    """ many probes - eg. 6 probes x N sessions x M days - stored as parallel numpy columns rather than a
+    Probe object each
 
-print(x)
-print(Probe.chr2idx("b"))
+    row i is one probe: index[i], session[i], day[i], coords[i], hole[i]. labels are derived from index, and
+    lookups by label convert a whole array of labels in one operation
+    """
+    __slots__ = ("index", "session", "day", "coords", "hole")
+
+    def __init__(self, index: Iterable[int], session: Iterable[int] = None, day: Iterable[int] = None,
+                 coords: np.ndarray = None, hole: Iterable[int] = None):
+        self.index = np.asarray(index, dtype=np.int8).reshape(-1)
+        n = len(self.index)
+        if np.any((self.index < 0) | (self.index >= probe_labels.MAX_PROBES)):
+            raise ValueError(f"Probe index must be in range [0-{probe_labels.MAX_PROBES-1}]")
+        self.session = np.zeros(n, dtype=np.int64) if session is None else np.asarray(session, dtype=np.int64)
+        self.day = np.zeros(n, dtype=np.int16) if day is None else np.asarray(day, dtype=np.int16)
+        self.coords = np.full((n, 2), np.nan, dtype=np.float32) if coords is None else np.asarray(coords, dtype=np.float32).reshape(n, 2)
+        self.hole = np.full(n, NO_HOLE, dtype=np.int16) if hole is None else np.asarray(hole, dtype=np.int16)
+
+    @classmethod
+    def from_labels(cls, labels: Iterable[str], **columns) -> "ProbeSet":
+        return cls(probe_labels.chr2idx(labels), **columns)
+
+    @classmethod
+    def from_probes(cls, probes: Iterable[Probe], **columns) -> "ProbeSet":
+        probes = list(probes)
+        coords = [p.coords if p.coords is not None else (np.nan, np.nan) for p in probes]
+        return cls([p.index for p in probes], coords=coords, **columns)
+
+    @property
+    def labels(self) -> np.ndarray:
+        return probe_labels.idx2chr(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, rows) -> "ProbeSet":
+        """ subset of rows, by slice, index array or boolean mask """
+        if isinstance(rows, (int, np.integer)):
+            rows = [rows]
+        return ProbeSet(self.index[rows], self.session[rows], self.day[rows], self.coords[rows], self.hole[rows])
+
+    def mask(self, label=None, session=None, day=None) -> np.ndarray:
+        """ boolean mask of rows matching label(s), session(s) and/or day(s) """
+        mask = np.ones(len(self), dtype=bool)
+        if label is not None:
+            mask &= np.isin(self.index, probe_labels.chr2idx(np.atleast_1d(label)))
+        if session is not None:
+            mask &= np.isin(self.session, session)
+        if day is not None:
+            mask &= np.isin(self.day, day)
+        return mask
+
+    def select(self, label=None, session=None, day=None) -> "ProbeSet":
+        """ eg. `select(label="B")` for every B probe, or `select(session=..., day=2)` """
+        return self[self.mask(label, session, day)]
+
+    def probe(self, row: int) -> Probe:
+        """ a single row as a Probe object """
+        probe = Probe(int(self.index[row]))
+        probe.coords = self.coords[row].tolist()
+        return probe
+
+
+if __name__ == '__main__':
+    x = [b, c, a] = [Probe(1), Probe("C"), Probe(0)]
+
+    print(x)
+    print(Probe.chr2idx("b"))
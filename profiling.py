@@ -0,0 +1,144 @@
+""" lightweight timing of hot paths in the browser and viewer
+
+wrap code in `with timer("name"):` or decorate a function with `@timed()`: each call's start and duration is
+kept in a fixed-size ring buffer per name, so timers can stay on permanently at the cost of a couple of
+perf_counter calls. `stats` summarizes the recent samples (p50/p95), and all samples can be exported as json or
+in chrome trace format (open in chrome://tracing or https://ui.perfetto.dev)
+
+headless - the Qt table that shows live stats is in profiling_dock.py
+"""
+import functools
+import json
+import pathlib
+import threading
+from time import perf_counter
+from typing import Callable, Union
+
+import numpy as np
+
+# samples kept for each timer name: older ones are overwritten
+PROFILE_BUFFER_SIZE = 1000
+
+_buffers = {} # {name: TimingBuffer}
+_lock = threading.Lock()
+_t0 = perf_counter() # zero for exported timestamps
+
+
+class TimingBuffer:
+    """ ring buffer of (start, duration, thread id) samples for one timer """
+
+    def __init__(self, size: int = PROFILE_BUFFER_SIZE):
+        self.start = np.zeros(size)
+        self.duration = np.zeros(size)
+        self.thread = np.zeros(size, dtype=np.int64)
+        self.count = 0 # total samples ever added
+
+    def add(self, start: float, duration: float, thread: int):
+        i = self.count % len(self.start)
+        self.start[i] = start
+        self.duration[i] = duration
+        self.thread[i] = thread
+        self.count += 1
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.start))
+
+    def samples(self) -> tuple:
+        """ (start, duration, thread) arrays of the samples still held, oldest first """
+        n = len(self)
+        order = (np.arange(n) + self.count) % n if self.count > n else np.arange(n)
+        return self.start[order], self.duration[order], self.thread[order]
+
+
+def record(name: str, start: float, duration: float):
+    """ add a sample: `start` from perf_counter, `duration` in seconds """
+    with _lock:
+        if name not in _buffers:
+            _buffers[name] = TimingBuffer()
+        _buffers[name].add(start, duration, threading.get_ident() & 0x7FFFFFFF)
+
+
+class timer:
+    """ context manager that records how long its block takes, including if it raises """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, perf_counter() - self.start)
+        return False
+
+
+def timed(name: str = None) -> Callable:
+    """ decorator that records every call of a function, under its name unless another is given
+
+    also works on bound methods of existing objects, eg. `imv.setImage = timed("imv.setImage")(imv.setImage)`
+    """
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, start, perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def clear():
+    with _lock:
+        _buffers.clear()
+
+
+def stats() -> dict:
+    """ summary of recent samples for each timer
+
+    Returns:
+        dict: {name: {"count": total calls, "p50_ms", "p95_ms", "max_ms": of the samples still held}}
+    """
+    with _lock:
+        summaries = {}
+        for name, buffer in sorted(_buffers.items()):
+            durations = buffer.samples()[1] * 1e3
+            p50, p95 = np.percentile(durations, [50, 95])
+            summaries[name] = {
+                "count": buffer.count, "p50_ms": float(p50), "p95_ms": float(p95), "max_ms": float(durations.max()),
+            }
+    return summaries
+
+
+def export_json(path: Union[str, pathlib.Path]):
+    """ stats plus every sample still held, with start times in seconds since this module was imported """
+    with _lock:
+        samples = {
+            name: [
+                {"start_s": float(start - _t0), "duration_ms": float(duration * 1e3), "thread": int(thread)}
+                for start, duration, thread in zip(*buffer.samples())
+            ]
+            for name, buffer in _buffers.items()
+        }
+    with open(path, "w") as f:
+        json.dump({"stats": stats(), "samples": samples}, f, indent=4)
+
+
+def export_chrome_trace(path: Union[str, pathlib.Path]):
+    """ every sample still held as a complete ("X") event in the chrome trace event format """
+    with _lock:
+        events = [
+            {
+                "name": name, "ph": "X", "pid": 0, "tid": int(thread),
+                "ts": float((start - _t0) * 1e6), "dur": float(duration * 1e6),
+            }
+            for name, buffer in _buffers.items()
+            for start, duration, thread in zip(*buffer.samples())
+        ]
+    events.sort(key=lambda event: event["ts"])
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
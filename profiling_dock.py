@@ -0,0 +1,73 @@
+""" live table of hot-path timings (see profiling.py), as a window or a dock in a QMainWindow """
+from PyQt5 import QtCore, QtWidgets
+
+import profiling
+
+# ms between table updates
+REFRESH_INTERVAL_MS = 1000
+
+COLUMNS = ("timer", "calls", "p50 ms", "p95 ms", "max ms")
+
+
+class TimingTable(QtWidgets.QWidget):
+    """ p50/p95/max latency of every timer, refreshed while visible, with buttons to export the samples """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.table = QtWidgets.QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+
+        export_json = QtWidgets.QPushButton("Export JSON")
+        export_json.clicked.connect(lambda: self.export(profiling.export_json, "JSON (*.json)"))
+        export_trace = QtWidgets.QPushButton("Export Chrome trace")
+        export_trace.clicked.connect(lambda: self.export(profiling.export_chrome_trace, "Chrome trace (*.json)"))
+        clear = QtWidgets.QPushButton("Clear")
+        clear.clicked.connect(profiling.clear)
+        clear.clicked.connect(self.refresh)
+
+        buttons = QtWidgets.QHBoxLayout()
+        for button in (export_json, export_trace, clear):
+            buttons.addWidget(button)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.timer = QtCore.QTimer(self, interval=REFRESH_INTERVAL_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        stats = profiling.stats()
+        self.table.setRowCount(len(stats))
+        for row, (name, summary) in enumerate(stats.items()):
+            values = (name, summary["count"], summary["p50_ms"], summary["p95_ms"], summary["max_ms"])
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else str(value)
+                item = QtWidgets.QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        self.table.resizeColumnsToContents()
+
+    def export(self, export_function, file_filter: str):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export timings", "timings.json", file_filter)
+        if path:
+            export_function(path)
+
+
+class TimingDock(QtWidgets.QDockWidget):
+
+    def __init__(self, parent=None):
+        super().__init__("Timings", parent)
+        self.setWidget(TimingTable(self))
@@ -2,12 +2,21 @@
 #     from PySide6 import QtGui, QtCore, QtWidgets
 # except:
 import os
-from datetime import timedelta
+import subprocess
+import sys
 from pathlib import Path, PurePath, PureWindowsPath
-from time import time
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from directory_prefetch import DIRECTORY_CACHE_MAX_AGE_S, DirectoryCache, DirectoryPrefetcher
+from folder_watcher import SessionFolderWatcher
+from profiling import timed
+from profiling_dock import TimingTable
+from session_index import SessionIndex
+from session_models import (DebouncedFilter, RootProber, SessionFilterProxyModel,
+                            SessionIndexer, expand_to_matches)
+from thumbnails import THUMBNAIL_SIZE, ThumbnailModel
+
 root_pathlist = [
     # PureWindowsPath(r"\\allen\programs\mindscope\workgroups\np-exp"),
     PureWindowsPath(r"\\W10DTSM112719\neuropixels_data"),
@@ -33,18 +42,30 @@ root_pathlist = [
 tempDir = QtCore.QTemporaryDir(os.path.join(QtCore.QDir.tempPath(), "X" * 16))
 tempDirPathObj = Path(tempDir.path())
 
-for path in root_pathlist:
-    tf = QtCore.QFile.link(
-        str(path),
-        str(
-            tempDirPathObj
-            / (
-                str(path).replace("\\\\", "").replace("\\", "_").replace(":", "")
-                + ".lnk"
-            )
-        ),
+# {root: path of its link in tempDir}, for roots that responded at startup
+root_linkpaths = {}
+
+
+def rootLinkPath(path):
+    return str(
+        tempDirPathObj
+        / (
+            str(path).replace("\\\\", "").replace("\\", "_").replace(":", "")
+            + ".lnk"
+        )
     )
 
+
+def linkRoot(path, elapsed):
+    """ link a root into tempDir once it has responded, or add a local placeholder folder if it's unavailable,
+    so the file model never has to wait on a dead share """
+    if elapsed is None:
+        QtCore.QDir().mkpath(rootLinkPath(path) + " (unavailable)")
+        return
+    root_linkpaths[str(path)] = rootLinkPath(path)
+    tf = QtCore.QFile.link(str(path), root_linkpaths[str(path)])
+
+
 app = QtWidgets.QApplication([])
 
 fileModel = QtWidgets.QFileSystemModel()
@@ -57,7 +78,7 @@ fileModel.setFilter(QtCore.QDir.AllDirs | QtCore.QDir.NoDotAndDotDot)
 # )
 # root_idx = fileModel.index(doc_directory)
 
-proxyModel = QtCore.QSortFilterProxyModel()
+proxyModel = SessionFilterProxyModel()
 proxyModel.setSourceModel(fileModel)
 # proxyModel.isSortLocaleAware()
 # self.searchBox = QLineEdit(centralWidget)
@@ -81,8 +102,6 @@ proxyModel.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
 # proxyModel.filterRegExp()
 # layout = QtWidgets.QVBoxLayout()
 
-# TODO add better expanding (See https://stackoverflow.com/questions/56781145/expand-specific-items-in-a-treeview-during-filtering)
-
 treeView = QtWidgets.QTreeView()
 treeView.setModel(proxyModel)
 treeView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
@@ -90,6 +109,39 @@ treeView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
 treeView.setUniformRowHeights(True)
 treeView.setFixedSize(1200, 800)
 
+# listings of the folders on screen, fetched in bulk before they're expanded (one network round trip each)
+directoryCache = DirectoryCache()
+directoryPrefetcher = DirectoryPrefetcher(directoryCache)
+proxyModel.setDirectoryCache(directoryCache)
+
+
+def visibleFolders():
+    """ paths of the folders in the rows currently on screen in the tree """
+    folders = []
+    bottom = treeView.viewport().height()
+    proxyIndex = treeView.indexAt(QtCore.QPoint(0, 0))
+    while proxyIndex.isValid() and treeView.visualRect(proxyIndex).top() < bottom:
+        fileIndex = proxyModel.mapToSource(proxyIndex)
+        if fileModel.isDir(fileIndex):
+            folders.append(fileModel.filePath(fileIndex))
+        proxyIndex = treeView.indexBelow(proxyIndex)
+    return folders
+
+
+prefetchTimer = QtCore.QTimer(singleShot=True, interval=100)
+prefetchTimer.timeout.connect(lambda: directoryPrefetcher.prefetch(visibleFolders()))
+treeView.verticalScrollBar().valueChanged.connect(lambda *args: prefetchTimer.start())
+treeView.expanded.connect(lambda *args: prefetchTimer.start())
+proxyModel.rowsInserted.connect(lambda *args: prefetchTimer.start())
+# expand arrows depend on the listings, but the tree only asks whether a row has children when it lays out
+relayoutTimer = QtCore.QTimer(singleShot=True, interval=200)
+relayoutTimer.timeout.connect(treeView.scheduleDelayedItemsLayout)
+directoryPrefetcher.directoryListed.connect(lambda folder: relayoutTimer.start())
+# listings expire: list the folders on screen again, so changes show up without scrolling
+refreshListingsTimer = QtCore.QTimer(interval=DIRECTORY_CACHE_MAX_AGE_S * 1000)
+refreshListingsTimer.timeout.connect(prefetchTimer.start)
+refreshListingsTimer.start()
+
 clipboard = QtGui.QGuiApplication.clipboard()
 
 
@@ -109,56 +161,117 @@ def openContainingFolder(proxyIndex):
 treeView.clicked.connect(copyPathToClipboard)
 treeView.doubleClicked.connect(openContainingFolder)
 
-filterStr = QtWidgets.QLineEdit(placeholderText="Enter mouseID")
+# thumbnails of the images in the folder last clicked in the tree
+thumbnailModel = ThumbnailModel(directory_cache=directoryCache)
+thumbnailView = QtWidgets.QListView()
+thumbnailView.setViewMode(QtWidgets.QListView.IconMode)
+thumbnailView.setResizeMode(QtWidgets.QListView.Adjust)
+thumbnailView.setUniformItemSizes(True)
+thumbnailView.setIconSize(QtCore.QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+thumbnailView.setModel(thumbnailModel)
+
+
+def showThumbnails(proxyIndex):
+    fileIndex = proxyModel.mapToSource(proxyIndex)
+    if fileModel.isDir(fileIndex):
+        thumbnailModel.setFolder(fileModel.filePath(fileIndex))
 
-# TODO - allow filtering for any string within session id match (filter with pattern first, then filter results with lookaround?)
-# TODO - filemodel doesn't update when new folders are made - we need to trigger a refresh sometime: when updating the view ?
 
-lastUpdateTime = time()
+def openInViewer(thumbnailIndex):
+    """ open an image in the probe viewer, in its own process """
+    viewer = Path(__file__).with_name("pg_tests.py")
+    subprocess.Popen([sys.executable, str(viewer), thumbnailModel.imagePath(thumbnailIndex)])
 
 
-def setViewFilter(input_text):
-    global lastUpdateTime
-    treeView.expandToDepth(3)
-    if len(input_text) == 6:  # full mouseID
-        rePattern = f"[0-9]{{0,10}}_{input_text}_[0-9]{{0,8}}"
-    else:
-        rePattern = input_text
+treeView.clicked.connect(showThumbnails)
+thumbnailView.doubleClicked.connect(openInViewer)
 
-    sinceLastUpdate = timedelta(seconds=(time() - lastUpdateTime)).seconds
-    if sinceLastUpdate > 0:
-        # treeView.collapseAll()
-        proxyModel.setFilterRegularExpression("")
-        lastUpdateTime = time()
-    proxyModel.setFilterRegularExpression(rePattern)
+filterStr = QtWidgets.QLineEdit(placeholderText="Enter mouseID")
+
+# session folders on all roots, crawled in the background - filtering queries this instead of the network
+sessionIndex = SessionIndex()
+sessionIndexer = SessionIndexer(sessionIndex, root_pathlist)
+
+
+def indexedSessionPaths(input_text):
+    """ link paths of sessions in the index that match the filter text, or None if the index can't be used """
+    if not input_text or sessionIndex.is_empty():
+        return None
+    return [
+        os.path.join(root_linkpaths[root], relpath)
+        for root, relpath in sessionIndex.find(input_text)
+        if root in root_linkpaths
+    ]
+
+
+@timed()
+def setViewFilter(input_text, indexedPaths=None):
+    """ apply a filter in one go - `indexedPaths` are the matching sessions from the index, found off the GUI
+    thread by `viewFilter`, or None to filter the folders already loaded by their session keys instead """
+    if indexedPaths is not None:
+        proxyModel.setAcceptedPaths(indexedPaths)
+        updateTreeView()
+        return
+    proxyModel.setAcceptedPaths(None)
+    proxyModel.setSessionFilter(input_text)
     updateTreeView()
 
 
+# ms to wait after the last keystroke before filtering
+FILTER_DELAY_MS = 300
+
+viewFilter = DebouncedFilter(indexedSessionPaths, FILTER_DELAY_MS)
+viewFilter.resultReady.connect(setViewFilter)
+
+
+@timed()
 def expandTreeView():
-    global lastUpdateTime
-    sinceLastUpdate = timedelta(seconds=(time() - lastUpdateTime)).seconds
-    if sinceLastUpdate > 2:
-        # treeView.expandAll()
-        # treeView.expandToDepth(4)
-        # treeView.collapseAll()
-        lastUpdateTime = time()
+    # only the parents of matched sessions: expanding to a fixed depth would make the file model list every
+    # folder down to that depth on the network roots
+    expand_to_matches(treeView, proxyModel)
 
 
+@timed()
 def updateTreeView():
-    # global lastUpdateTime
     treeView.resizeColumnToContents(0)
     expandTreeView()
-    # sinceLastUpdate = timedelta(seconds=(time()-lastUpdateTime)).seconds
-    # if sinceLastUpdate > 0:
     # root_idx = fileModel.index(fileModel.rootPath())
     # proxy_root_idx = proxyModel.mapFromSource(root_idx)
     # treeView.setRootIndex(proxy_root_idx)
     # treeView.expandAll()
 
 
-proxyModel.dataChanged.connect(updateTreeView)
-proxyModel.rowsInserted.connect(updateTreeView)
-filterStr.textChanged.connect(setViewFilter)
+# rows arrive from the file model in many small batches: update the view once they've settled
+updateTimer = QtCore.QTimer(singleShot=True, interval=100)
+updateTimer.timeout.connect(updateTreeView)
+proxyModel.dataChanged.connect(lambda *args: updateTimer.start())
+proxyModel.rowsInserted.connect(lambda *args: updateTimer.start())
+filterStr.textChanged.connect(viewFilter.setText)
+# re-apply the current filter with fresh index results once crawling finishes
+sessionIndexer.finished.connect(lambda: viewFilter.setText(filterStr.text()))
+
+# after the first crawl, keep the index up to date by re-crawling only folders that change
+sessionWatcher = SessionFolderWatcher(sessionIndex)
+sessionIndexer.finished.connect(lambda: sessionWatcher.watch(root_linkpaths))
+
+
+def addNewSessions(root, relpaths):
+    """ push new session folders into the file model - it doesn't see new folders on network shares itself """
+    for relpath in relpaths:
+        path = os.path.join(root_linkpaths[root], relpath)
+        directoryCache.discard(os.path.dirname(path))
+        fileModel.index(path)
+    viewFilter.setText(filterStr.text())
+
+
+sessionWatcher.sessionsAdded.connect(addNewSessions)
+
+# check all roots concurrently off the GUI thread: each is linked as soon as it responds, and only roots
+# that responded are crawled for the index
+rootProber = RootProber(root_pathlist)
+rootProber.rootProbed.connect(linkRoot)
+rootProber.finished.connect(lambda responses: sessionIndexer.start(root_linkpaths))
+rootProber.start()
 
 fileModel.setRootPath(tempDir.path())
 root_idx = fileModel.index(fileModel.rootPath())
@@ -169,11 +282,20 @@ treeView.setRootIsDecorated(True)
 
 layout = QtWidgets.QVBoxLayout()
 layout.addWidget(filterStr)
-layout.addWidget(treeView)
+browserLayout = QtWidgets.QHBoxLayout()
+browserLayout.addWidget(treeView)
+browserLayout.addWidget(thumbnailView)
+layout.addLayout(browserLayout)
 mainWindow = QtWidgets.QWidget()
 mainWindow.setLayout(layout)
 mainWindow.show()
 
+# --profile: show a table of hot-path timings alongside the browser
+if "--profile" in sys.argv:
+    timingTable = TimingTable()
+    timingTable.setWindowTitle("Timings")
+    timingTable.show()
+
 
 # treeView.show()
 
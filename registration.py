@@ -0,0 +1,103 @@
+""" align insertion photos of the same implant taken on different days, so probe markers placed on one photo
+can be carried over to the next as starting positions
+
+alignment is by phase correlation of downsampled grayscale copies: one FFT of each image, and the peak of
+the inverse FFT of their normalized cross-power spectrum gives the translation between them. only translation
+is estimated - the camera and headframe are fixed, so photos differ mostly by small shifts of the mouse
+"""
+import math
+from typing import Tuple, Union
+
+import numpy as np
+
+# longest side of the images that are correlated, in pixels
+REGISTRATION_SIZE = 256
+
+# below this correlation peak height, in standard deviations of the whole correlation surface, the images
+# probably don't show the same implant: for unrelated images the highest of ~10^5 noise values is ~5 SD
+MIN_CONFIDENCE = 10
+
+
+def block_mean(image: np.ndarray, factor: int) -> np.ndarray:
+    """ grayscale float32 copy of an image reduced by averaging factor x factor blocks """
+    if image.ndim == 3:
+        image = image.mean(axis=2, dtype=np.float32)
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape(height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def phase_correlation(reference: np.ndarray, moving: np.ndarray) -> Tuple[float, float, float]:
+    """ translation of `moving` relative to `reference`, two grayscale arrays of the same shape
+
+    Returns:
+        dx, dy (float): shift in pixels, to sub-pixel precision - a feature at (x, y) in reference is at
+            (x + dx, y + dy) in moving
+        confidence (float): height of the correlation peak in standard deviations of the correlation surface
+    """
+    shape = reference.shape
+    # subtract the mean and taper the edges, so the image borders don't dominate the correlation
+    window = np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+    spectra = [np.fft.rfft2((image - image.mean()) * window) for image in (reference, moving)]
+    cross_power = spectra[1] * np.conj(spectra[0])
+    cross_power /= np.abs(cross_power) + 1e-12
+    correlation = np.fft.irfft2(cross_power, s=shape)
+
+    peak_y, peak_x = np.unravel_index(np.argmax(correlation), shape)
+    peak = correlation[peak_y, peak_x]
+    confidence = float(peak / correlation.std())
+
+    def refine(before, at, after) -> float:
+        """ offset of the peak of a parabola through three neighbouring samples """
+        denominator = before - 2 * at + after
+        return 0.5 * (before - after) / denominator if denominator else 0.0
+
+    dy = peak_y + refine(correlation[peak_y - 1, peak_x], peak, correlation[(peak_y + 1) % shape[0], peak_x])
+    dx = peak_x + refine(correlation[peak_y, peak_x - 1], peak, correlation[peak_y, (peak_x + 1) % shape[1]])
+    # peaks past halfway are negative shifts, wrapped around
+    dy = dy - shape[0] if dy > shape[0] / 2 else dy
+    dx = dx - shape[1] if dx > shape[1] / 2 else dx
+    return dx, dy, confidence
+
+
+def estimate_shift(reference: np.ndarray, image: np.ndarray, reference_scale: int = 1, image_scale: int = 1,
+                   size: int = REGISTRATION_SIZE) -> Tuple[float, float, float]:
+    """ translation of `image` relative to `reference`, in full-resolution pixels
+
+    either image can be a downsampled copy (eg. the coarsest level of an ImagePyramid) with `*_scale`
+    full-resolution pixels per pixel
+
+    Returns:
+        (dx, dy, confidence) - see `phase_correlation`
+    """
+    full_size = max(*reference.shape[:2]) * reference_scale, max(*image.shape[:2]) * image_scale
+    # full-resolution pixels per correlated pixel: rounded up so both images reduce to it by whole blocks
+    step = math.lcm(reference_scale, image_scale)
+    scale = max(1, math.ceil(max(full_size) / size / step)) * step
+
+    reference, image = block_mean(reference, scale // reference_scale), block_mean(image, scale // image_scale)
+    # zero-pad both to the same shape - the mean is subtracted before windowing, so padding adds no edges
+    shape = np.maximum(reference.shape, image.shape)
+    padded = []
+    for array in (reference, image):
+        out = np.full(shape, array.mean(), dtype=np.float32)
+        out[:array.shape[0], :array.shape[1]] = array
+        padded.append(out)
+    dx, dy, confidence = phase_correlation(*padded)
+    return float(dx * scale), float(dy * scale), confidence
+
+
+def carry_over(reference: np.ndarray, positions: np.ndarray, image: np.ndarray, reference_scale: int = 1,
+               image_scale: int = 1, min_confidence: float = MIN_CONFIDENCE) -> Union[np.ndarray, None]:
+    """ marker positions on a reference photo moved to where they should be on a new photo of the same implant
+
+    Args:
+        positions (np.ndarray): (n, 2) x, y in full-resolution pixels of the reference
+
+    Returns:
+        np.ndarray: (n, 2) x, y in full-resolution pixels of the new image, or None if it couldn't be aligned
+    """
+    shift = estimate_shift(reference, image, reference_scale, image_scale)
+    if shift[2] < min_confidence:
+        return None
+    return np.asarray(positions, dtype=float).reshape(-1, 2) + shift[:2]
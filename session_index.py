@@ -0,0 +1,252 @@
+""" local index of session folders found on the network roots, so the browser can be filtered without
+walking slow network shares on every keystroke
+
+session folders are named <lims>_<mouse>_<date>, eg. 1234567890_366122_20220530
+"""
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+from typing import Iterable, List, Tuple, Union
+
+# local sqlite file (in current working directory)
+SESSION_INDEX_DB = pathlib.Path("session_index.sqlite")
+
+# how many levels below each root to look for session folders
+MAX_DEPTH = 4
+
+session_reg_exp = re.compile(r"([0-9]{1,10})_([0-9]{6})_([0-9]{8})")
+
+
+def parse_session_name(folder_name: str) -> Union[Tuple[int, int, int], None]:
+    """ extract (lims_id, mouse_id, date) from a folder name containing <lims>_<mouse>_<date>, or return none
+
+    date is an int yyyymmdd, so sessions can be compared and sorted by date directly
+    """
+    match = session_reg_exp.search(folder_name)
+    if match is None:
+        return None
+    lims_id, mouse_id, date = match.groups()
+    return (int(lims_id), int(mouse_id), int(date))
+
+
+def relpath_depth(relpath: str) -> int:
+    """ number of levels a relpath is below its root """
+    return len(pathlib.PurePath(relpath).parts)
+
+
+def escape_like(text: str) -> str:
+    """ escape sqlite LIKE wildcards (with escape character backslash) so text is matched literally """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def crawl_root(root: str, max_depth: int = MAX_DEPTH, start: str = "") -> Tuple[list, list]:
+    """ walk a root folder looking for session folders, without descending into them
+
+    each folder is listed with one scandir - on a network share that's one round trip per folder, however many
+    subfolders it has. only folders that are crawled further are stat-ed, for their modification time (free
+    from the listing on windows)
+
+    Args:
+        root (str): folder to crawl
+        max_depth (int): levels below root to search
+        start (str): relpath of a folder within root to crawl, instead of the whole root
+
+    Returns:
+        sessions (list): [(relpath, folder name, lims_id, mouse_id, date)]
+        folders (list): [(relpath, mtime_ns, [subfolder names])] for every non-session folder visited
+    """
+    sessions = []
+    folders = []
+
+    try:
+        start_mtime = os.stat(os.path.join(root, start) if start else root).st_mtime_ns
+    except OSError:
+        return sessions, folders
+
+    stack = [(start, start_mtime, relpath_depth(start))]
+    while stack:
+        relpath, mtime, depth = stack.pop()
+        path = os.path.join(root, relpath) if relpath else root
+
+        subfolders = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_dir():
+                            continue
+                        subfolders.append(entry.name)
+                        sub_relpath = os.path.join(relpath, entry.name) if relpath else entry.name
+                        session = parse_session_name(entry.name)
+                        if session is not None:
+                            sessions.append((sub_relpath, entry.name, *session))
+                        elif depth + 1 < max_depth:
+                            stack.append((sub_relpath, entry.stat().st_mtime_ns, depth + 1))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+        folders.append((relpath, mtime, subfolders))
+
+    return sessions, folders
+
+
+class SessionIndex:
+    """ sqlite index of session folders on a list of roots
+
+    safe to query from one thread (eg. the GUI) while another refreshes it
+    """
+
+    def __init__(self, db_path: Union[str, pathlib.Path] = SESSION_INDEX_DB):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    root TEXT, relpath TEXT, name TEXT, lims_id INTEGER, mouse_id INTEGER, date INTEGER,
+                    PRIMARY KEY (root, relpath)
+                );
+                CREATE INDEX IF NOT EXISTS sessions_mouse_id ON sessions (mouse_id);
+                CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+                CREATE TABLE IF NOT EXISTS folders (
+                    root TEXT, relpath TEXT, mtime_ns INTEGER, subfolders TEXT,
+                    PRIMARY KEY (root, relpath)
+                );
+                CREATE TABLE IF NOT EXISTS roots (
+                    root TEXT PRIMARY KEY, last_crawled REAL
+                );
+            """)
+
+    def update_root(self, root: str, sessions: list, folders: list):
+        """ replace everything stored for a root with the results of a new crawl """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM sessions WHERE root = ?", (root,))
+            self.db.execute("DELETE FROM folders WHERE root = ?", (root,))
+            self.db.executemany(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)", ((root, *s) for s in sessions)
+            )
+            self.db.executemany(
+                "INSERT INTO folders VALUES (?, ?, ?, ?)",
+                ((root, relpath, mtime, "\n".join(subfolders)) for relpath, mtime, subfolders in folders),
+            )
+            self.db.execute("INSERT OR REPLACE INTO roots VALUES (?, ?)", (root, time()))
+
+    def update_folder(self, root: str, relpath: str, sessions: list, folders: list):
+        """ replace everything stored for a folder within a root, and below it, with the results of a new crawl """
+        if not relpath:
+            self.update_root(root, sessions, folders)
+            return
+        where = "root = ? AND (relpath = ? OR relpath LIKE ? ESCAPE '\\')"
+        params = (root, relpath, escape_like(relpath + os.sep) + "%")
+        with self.lock, self.db:
+            self.db.execute(f"DELETE FROM sessions WHERE {where}", params)
+            self.db.execute(f"DELETE FROM folders WHERE {where}", params)
+            self.db.executemany(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)", ((root, *s) for s in sessions)
+            )
+            self.db.executemany(
+                "INSERT INTO folders VALUES (?, ?, ?, ?)",
+                ((root, folder, mtime, "\n".join(subfolders)) for folder, mtime, subfolders in folders),
+            )
+
+    def refresh_folder(self, root: str, relpath: str, max_depth: int = MAX_DEPTH) -> list:
+        """ re-crawl one folder that has changed, rather than its whole root
+
+        Returns:
+            list: relpaths of session folders that weren't in the index before
+        """
+        root = str(root)
+        sessions, folders = crawl_root(root, max_depth, start=relpath)
+        if not folders: # folder no longer reachable
+            return []
+        with self.lock:
+            known_sessions = {
+                row[0] for row in self.db.execute("SELECT relpath FROM sessions WHERE root = ?", (root,))
+            }
+        self.update_folder(root, relpath, sessions, folders)
+        return [session[0] for session in sessions if session[0] not in known_sessions]
+
+    def watch_folders(self, root: str) -> dict:
+        """ folders worth watching for new sessions: the root itself, plus every folder that already contains
+        sessions
+
+        Returns:
+            dict: {relpath: mtime_ns when last crawled}
+        """
+        with self.lock:
+            session_relpaths = [
+                row[0] for row in self.db.execute("SELECT relpath FROM sessions WHERE root = ?", (str(root),))
+            ]
+            folder_mtimes = dict(
+                self.db.execute("SELECT relpath, mtime_ns FROM folders WHERE root = ?", (str(root),)).fetchall()
+            )
+        watched = {""} | {os.path.dirname(relpath) for relpath in session_relpaths}
+        return {relpath: folder_mtimes[relpath] for relpath in watched if relpath in folder_mtimes}
+
+    def refresh(self, roots: Iterable, max_depth: int = MAX_DEPTH, max_workers: int = 8):
+        """ crawl all roots in parallel, updating the index as each one finishes """
+        roots = [str(root) for root in roots]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(crawl_root, root, max_depth): root for root in roots}
+            for future in as_completed(futures):
+                root = futures[future]
+                try:
+                    sessions, folders = future.result()
+                except Exception as e:
+                    print(f"failed to crawl {root=}: {e!r}") # todo logging
+                    continue
+                if folders: # root was reachable
+                    self.update_root(root, sessions, folders)
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM roots LIMIT 1").fetchone() is None
+
+    def sessions(self, mouse_ids: Iterable[int] = None, start_date: int = None,
+                 end_date: int = None) -> List[Tuple[str, str, str, int, int]]:
+        """ all indexed sessions, or those for a list of mice and/or a range of dates (yyyymmdd, inclusive)
+
+        Returns:
+            list: [(root, relpath, folder name, mouse_id, date)], sorted by date
+        """
+        conditions, params = [], []
+        if mouse_ids is not None:
+            mouse_ids = [int(m) for m in mouse_ids]
+            conditions.append(f"mouse_id IN ({', '.join('?' * len(mouse_ids))})")
+            params += mouse_ids
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(int(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(int(end_date))
+        with self.lock:
+            return self.db.execute(
+                f"SELECT root, relpath, name, mouse_id, date FROM sessions WHERE {' AND '.join(conditions) or '1'} "
+                "ORDER BY date, name",
+                params,
+            ).fetchall()
+
+    def find(self, text: str) -> List[Tuple[str, str]]:
+        """ sessions matching filter text: a full 6-digit mouseID uses the mouse_id index, anything else
+        matches any part of the session folder name
+
+        Returns:
+            list: [(root, relpath)]
+        """
+        with self.lock:
+            if len(text) == 6 and text.isdigit():
+                rows = self.db.execute(
+                    "SELECT root, relpath FROM sessions WHERE mouse_id = ?", (int(text),)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT root, relpath FROM sessions WHERE name LIKE ? ESCAPE '\\'", (f"%{escape_like(text)}%",)
+                ).fetchall()
+        return rows
@@ -0,0 +1,286 @@
+""" Qt models and workers for the session folder browser (qabs_model_test.py) """
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Union
+
+from PyQt5 import QtCore, QtWidgets
+
+from directory_prefetch import DirectoryCache
+from network_roots import ROOT_TIMEOUT, probe_roots
+from session_index import SessionIndex, parse_session_name
+
+
+# limit on the number of matched sessions whose parent folders are expanded after filtering
+MAX_EXPANDED_MATCHES = 500
+
+
+def cleanpath(path: str) -> str:
+    """ forward slashes and no redundant separators, in the path's own case, as QFileSystemModel expects """
+    return QtCore.QDir.cleanPath(QtCore.QDir.fromNativeSeparators(str(path)))
+
+
+def normpath(path: str) -> str:
+    """ single format for paths from QFileSystemModel and from the session index, for comparisons """
+    return cleanpath(path).lower()
+
+
+class SessionFilterProxyModel(QtCore.QSortFilterProxyModel):
+    """ proxy for a QFileSystemModel that filters session folders by their parsed <lims>_<mouse>_<date> keys
+    instead of running a regular expression over every row's display string
+
+    each folder name is parsed once and its key cached, so re-filtering is integer comparisons and substring
+    tests against cached values. sessions seen so far are also kept in a mouseID -> sessions hash index
+
+    two ways to filter:
+        - `setAcceptedPaths`: show a set of session folders found in the session index, plus their parent
+        folders and anything inside them
+        - `setSessionFilter`: match a full 6-digit mouseID, or any other text within a session folder's name,
+        showing matched session folders and anything inside them (parents are shown by recursive filtering)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepted_paths = None # {normpath: path in its original case, for making source indexes}
+        self.accepted_parents = None
+        self.session_filter = None
+        self.session_keys = {}     # {source internalId: ((lims_id, mouse_id, date), lower-case name) or None}
+        self.session_indexes = {}  # {source internalId: QPersistentModelIndex} for session folders only
+        self.mouse_sessions = {}   # {mouse_id: {source internalId of session folder}}
+        self.directory_cache = None # DirectoryCache of prefetched folder listings, if any
+
+    def setSourceModel(self, source_model: QtCore.QAbstractItemModel):
+        super().setSourceModel(source_model)
+        self.clearSessionKeys()
+        source_model.modelReset.connect(self.clearSessionKeys)
+        source_model.rowsAboutToBeRemoved.connect(self.removeSessionKeys)
+
+    def clearSessionKeys(self):
+        self.session_keys.clear()
+        self.session_indexes.clear()
+        self.mouse_sessions.clear()
+
+    def removeSessionKeys(self, source_parent: QtCore.QModelIndex, first: int, last: int):
+        """ forget the keys of rows about to be removed from the source model, and of everything below them -
+        keys are stored by internalId, which the file model can give to a new folder once the old one is gone """
+        source_model = self.sourceModel()
+        stack = [source_model.index(row, 0, source_parent) for row in range(first, last + 1)]
+        while stack:
+            source_index = stack.pop()
+            key = self.session_keys.pop(source_index.internalId(), None)
+            if key is not None:
+                self.session_indexes.pop(source_index.internalId(), None)
+                self.mouse_sessions.get(key[0][1], set()).discard(source_index.internalId())
+            # rowCount only counts rows already loaded, so this never lists a folder
+            stack += [source_model.index(row, 0, source_index) for row in range(source_model.rowCount(source_index))]
+
+    def sessionKey(self, source_index: QtCore.QModelIndex) -> Union[tuple, None]:
+        """ cached ((lims_id, mouse_id, date), lower-case name) for a session folder in the source model, or
+        None for any other folder """
+        key_id = source_index.internalId()
+        try:
+            return self.session_keys[key_id]
+        except KeyError:
+            pass
+        name = source_index.data()
+        key = parse_session_name(name) if name else None
+        if key is not None:
+            self.session_indexes[key_id] = QtCore.QPersistentModelIndex(source_index)
+            self.mouse_sessions.setdefault(key[1], set()).add(key_id)
+            key = (key, name.lower())
+        self.session_keys[key_id] = key
+        return key
+
+    def setAcceptedPaths(self, paths: Union[Iterable[str], None]):
+        if paths is None:
+            self.accepted_paths = self.accepted_parents = None
+        else:
+            self.accepted_paths = {normpath(path): cleanpath(path) for path in paths}
+            self.accepted_parents = set()
+            for path in self.accepted_paths:
+                parent = os.path.dirname(path)
+                while parent not in self.accepted_parents:
+                    self.accepted_parents.add(parent)
+                    if os.path.dirname(parent) == parent:
+                        break
+                    parent = os.path.dirname(parent)
+        self.invalidateFilter()
+
+    def setSessionFilter(self, text: str):
+        text = text.strip()
+        if not text:
+            self.session_filter = None
+        elif len(text) == 6 and text.isdigit(): # full mouseID
+            self.session_filter = ("mouse_id", int(text))
+        else:
+            self.session_filter = ("text", text.lower())
+        self.invalidateFilter()
+
+    def sessionMatches(self, key: tuple) -> bool:
+        (_, mouse_id, _), name = key
+        kind, value = self.session_filter
+        if kind == "mouse_id":
+            return mouse_id == value
+        return value in name
+
+    def matchedSourceIndexes(self, max_matches: int = None) -> list:
+        """ source model indexes of the session folders that match the current filter - from the accepted
+        paths or the cached session keys, without visiting any other rows. `max_matches` is applied before any
+        index is made, since making one for an accepted path stats each folder on its path """
+        source_model = self.sourceModel()
+        if self.accepted_paths is not None:
+            return [source_model.index(path) for path in itertools.islice(self.accepted_paths.values(), max_matches)]
+        if self.session_filter is None:
+            return []
+        kind, value = self.session_filter
+        if kind == "mouse_id":
+            key_ids = self.mouse_sessions.get(value, ())
+        else:
+            key_ids = (key_id for key_id in self.session_indexes if self.sessionMatches(self.session_keys[key_id]))
+        indexes = (QtCore.QModelIndex(self.session_indexes[key_id]) for key_id in key_ids)
+        return list(itertools.islice((index for index in indexes if index.isValid()), max_matches))
+
+    def setDirectoryCache(self, directory_cache: DirectoryCache):
+        self.directory_cache = directory_cache
+
+    def hasChildren(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> bool:
+        """ folders whose prefetched listing has no subfolders get no expand arrow, so aren't expanded (and
+        listed again by the file model) for nothing """
+        if self.directory_cache is not None and parent.isValid():
+            entries = self.directory_cache.get(self.sourceModel().filePath(self.mapToSource(parent)))
+            if entries is not None:
+                return any(entry.is_dir for entry in entries)
+        return super().hasChildren(parent)
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QtCore.QModelIndex) -> bool:
+        if self.accepted_paths is not None:
+            return self.pathAccepted(source_row, source_parent)
+        if self.session_filter is None:
+            return True
+
+        # the session folder itself, or anything inside it
+        source_index = self.sourceModel().index(source_row, 0, source_parent)
+        while source_index.isValid():
+            key = self.sessionKey(source_index)
+            if key is not None:
+                return self.sessionMatches(key)
+            source_index = source_index.parent()
+        return False
+
+    def pathAccepted(self, source_row: int, source_parent: QtCore.QModelIndex) -> bool:
+        path = normpath(self.sourceModel().filePath(self.sourceModel().index(source_row, 0, source_parent)))
+        if path in self.accepted_parents:
+            return True
+        # the session folder itself, or anything inside it
+        while path:
+            if path in self.accepted_paths:
+                return True
+            parent = os.path.dirname(path)
+            path = parent if parent != path else ""
+        return False
+
+
+def expand_to_matches(tree_view: QtWidgets.QTreeView, proxy_model: SessionFilterProxyModel,
+                      max_matches: int = MAX_EXPANDED_MATCHES):
+    """ expand only the parent folders of session folders that match the current filter
+
+    unlike `expandToDepth`, this never asks the file model to list folders that don't lead to a match, so the
+    cost scales with the number of matches rather than the size of the tree. matched session folders are left
+    collapsed, so their contents are only fetched if they're expanded by hand
+    """
+    to_expand = {} # {source internalId: proxy index}, shared parents are only visited once
+    for source_index in proxy_model.matchedSourceIndexes(max_matches):
+        source_index = source_index.parent()
+        while source_index.isValid() and source_index.internalId() not in to_expand:
+            proxy_index = proxy_model.mapFromSource(source_index)
+            if not proxy_index.isValid():
+                break
+            to_expand[source_index.internalId()] = QtCore.QPersistentModelIndex(proxy_index)
+            source_index = source_index.parent()
+    for proxy_index in to_expand.values():
+        proxy_index = QtCore.QModelIndex(proxy_index)
+        if proxy_index.isValid() and not tree_view.isExpanded(proxy_index):
+            tree_view.expand(proxy_index)
+
+
+class DebouncedFilter(QtCore.QObject):
+    """ runs a slow filter function off the GUI thread, only once typing has paused
+
+    each change of text restarts a timer, so typing a 6-digit mouseID gives one filter pass, not six. when the
+    timer fires, the filter runs on a worker thread: queued runs for superseded text are cancelled and results
+    that arrive for superseded text are dropped, so only the latest result is ever delivered
+    """
+
+    resultReady = QtCore.pyqtSignal(str, object) # text, result of filter function
+
+    def __init__(self, filter_function: Callable[[str], object], delay_ms: int = 300, parent=None):
+        super().__init__(parent)
+        self.filter_function = filter_function
+        self.text = ""
+        self.future = None
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.timer = QtCore.QTimer(self, singleShot=True, interval=delay_ms)
+        self.timer.timeout.connect(self.run)
+
+    def setDelay(self, delay_ms: int):
+        self.timer.setInterval(delay_ms)
+
+    def setText(self, text: str):
+        self.text = text
+        self.timer.start() # restarts if already running
+
+    def run(self):
+        if self.future is not None:
+            self.future.cancel() # only succeeds if it hasn't started yet
+        text = self.text
+        self.future = self.pool.submit(self.filter_function, text)
+        self.future.add_done_callback(lambda future: self.deliver(text, future))
+
+    def deliver(self, text, future):
+        if future.cancelled() or text != self.text:
+            return
+        self.resultReady.emit(text, future.result()) # delivered to slots on the GUI thread
+
+
+class SessionIndexer(QtCore.QObject):
+    """ refreshes a SessionIndex on a background thread and signals when it's done """
+
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, session_index: SessionIndex, roots: Iterable, parent=None):
+        super().__init__(parent)
+        self.session_index = session_index
+        self.roots = list(roots)
+        self.thread = None
+
+    def start(self, roots: Iterable = None):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        if roots is not None:
+            self.roots = list(roots)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        self.session_index.refresh(self.roots)
+        self.finished.emit() # delivered to slots on the GUI thread
+
+
+class RootProber(QtCore.QObject):
+    """ checks all network roots concurrently on a background thread, signalling each result as it arrives """
+
+    rootProbed = QtCore.pyqtSignal(str, object) # root, seconds to respond or None if unavailable
+    finished = QtCore.pyqtSignal(dict)          # {root: seconds to respond or None}
+
+    def __init__(self, roots: Iterable, timeout: float = ROOT_TIMEOUT, parent=None):
+        super().__init__(parent)
+        self.roots = list(roots)
+        self.timeout = timeout
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        responses = probe_roots(self.roots, self.timeout, on_result=self.rootProbed.emit)
+        self.finished.emit(responses)
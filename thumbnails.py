@@ -0,0 +1,173 @@
+""" thumbnail grid of the insertion photos in a session folder, for the session folder browser
+(qabs_model_test.py)
+
+thumbnails are generated on a bounded pool of worker threads, only for rows the view actually asks to draw,
+and cached on disk under a key made from each image's path, modification time and size - so each image is
+read from the network once, ever, unless it changes. the folder listing comes from one os.scandir call, whose
+entries carry the stat info the keys need
+"""
+import hashlib
+import os
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+from PyQt5 import QtCore, QtGui
+
+from directory_prefetch import DirectoryCache, list_directory
+from image_pyramid import IMAGE_SUFFIXES
+
+# thumbnails (in current working directory)
+THUMBNAIL_CACHE_DIR = pathlib.Path("thumbnail_cache")
+
+# longest side of a thumbnail, in pixels
+THUMBNAIL_SIZE = 160
+
+# threads generating thumbnails at once - more just queue up more network reads
+THUMBNAIL_WORKERS = 4
+
+
+def thumbnail_key(image_path: str, mtime_ns: int, size: int) -> str:
+    """ name for an image's cached thumbnail - changes if the image file is modified """
+    return hashlib.sha1(repr((str(image_path), mtime_ns, size)).encode()).hexdigest()
+
+
+def list_images(folder: Union[str, pathlib.Path], directory_cache: DirectoryCache = None) -> List[Tuple[str, int, int]]:
+    """ images in a folder, sorted by name, from a single directory listing - which also refreshes the folder's
+    listing in `directory_cache`, if given
+
+    Returns:
+        list: [(path, mtime_ns, size)]
+    """
+    entries = list_directory(str(folder))
+    if directory_cache is not None:
+        directory_cache.put(str(folder), entries)
+    return [
+        (os.path.join(folder, entry.name), entry.mtime_ns, entry.size)
+        for entry in entries
+        if not entry.is_dir and os.path.splitext(entry.name)[1].lower() in IMAGE_SUFFIXES
+    ]
+
+
+def load_thumbnail(image_path: str, mtime_ns: int, size: int, cache_dir: pathlib.Path = THUMBNAIL_CACHE_DIR,
+                   thumbnail_size: int = THUMBNAIL_SIZE) -> QtGui.QImage:
+    """ cached thumbnail of an image, generating and caching it if it hasn't been seen before - safe to call
+    from worker threads (QImage, unlike QPixmap, doesn't need the GUI thread) """
+    cache_file = pathlib.Path(cache_dir) / f"{thumbnail_key(image_path, mtime_ns, size)}.png"
+    thumbnail = QtGui.QImage(str(cache_file))
+    if not thumbnail.isNull():
+        return thumbnail
+
+    reader = QtGui.QImageReader(image_path)
+    reader.setAutoTransform(True)
+    full_size = reader.size()
+    if full_size.isValid():
+        # decoders that support it (eg. jpeg) decode straight to the reduced size
+        reader.setScaledSize(full_size.scaled(thumbnail_size, thumbnail_size, QtCore.Qt.KeepAspectRatio))
+    thumbnail = reader.read()
+    if thumbnail.isNull():
+        raise OSError(f"could not read image {image_path}: {reader.errorString()}")
+    if max(thumbnail.width(), thumbnail.height()) > thumbnail_size:
+        thumbnail = thumbnail.scaled(thumbnail_size, thumbnail_size, QtCore.Qt.KeepAspectRatio,
+                                     QtCore.Qt.SmoothTransformation)
+
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    # write under a temporary name so a partly-written thumbnail is never loaded
+    tmp_file = cache_file.with_name(f"{cache_file.stem}.{threading.get_ident()}.tmp.png")
+    if thumbnail.save(str(tmp_file)):
+        os.replace(tmp_file, cache_file)
+    return thumbnail
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """ the images in one folder, for a QListView in icon mode
+
+    rows are listed on a worker thread. a thumbnail is only requested the first time the view asks for a row's
+    icon (ie. when it's first drawn) and the row is updated when it arrives - until then it shows a placeholder
+    """
+
+    folderListed = QtCore.pyqtSignal(int, str, list)              # generation, folder, [(path, mtime, size)]
+    thumbnailReady = QtCore.pyqtSignal(int, int, QtGui.QImage)    # generation, row, thumbnail
+
+    def __init__(self, cache_dir: pathlib.Path = THUMBNAIL_CACHE_DIR, max_workers: int = THUMBNAIL_WORKERS,
+                 directory_cache: DirectoryCache = None, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir
+        self.directory_cache = directory_cache
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.folder = None
+        self.images = []      # [(path, mtime_ns, size)]
+        self.icons = {}       # {row: QIcon}
+        self.requested = {}   # {row: Future}
+        self.generation = 0   # incremented for each folder, so late results for a previous folder are dropped
+        placeholder = QtGui.QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        placeholder.fill(QtGui.QColor("lightgray"))
+        self.placeholder = QtGui.QIcon(placeholder)
+        self.folderListed.connect(self.onFolderListed)
+        self.thumbnailReady.connect(self.onThumbnailReady)
+
+    def setFolder(self, folder: Union[str, pathlib.Path]):
+        self.generation += 1
+        for future in self.requested.values():
+            future.cancel()
+        self.beginResetModel()
+        self.folder = str(folder)
+        self.images, self.icons, self.requested = [], {}, {}
+        self.endResetModel()
+        self.pool.submit(self.listFolder, self.generation, self.folder)
+
+    def listFolder(self, generation: int, folder: str):
+        try:
+            images = list_images(folder, self.directory_cache)
+        except OSError as e:
+            print(f"could not list {folder=}: {e!r}") # todo logging
+            return
+        self.folderListed.emit(generation, folder, images) # delivered to slots on the GUI thread
+
+    def onFolderListed(self, generation: int, folder: str, images: list):
+        if generation != self.generation or not images:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, len(images) - 1)
+        self.images = images
+        self.endInsertRows()
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.images)
+
+    def data(self, index: QtCore.QModelIndex, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.images):
+            return None
+        row = index.row()
+        path = self.images[row][0]
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.basename(path)
+        if role in (QtCore.Qt.ToolTipRole, QtCore.Qt.UserRole):
+            return path
+        if role == QtCore.Qt.DecorationRole:
+            if row in self.icons:
+                return self.icons[row]
+            if row not in self.requested:
+                self.requested[row] = self.pool.submit(self.generate, self.generation, row, *self.images[row])
+            return self.placeholder
+        return None
+
+    def generate(self, generation: int, row: int, path: str, mtime_ns: int, size: int):
+        if generation != self.generation:
+            return
+        try:
+            thumbnail = load_thumbnail(path, mtime_ns, size, self.cache_dir)
+        except OSError as e:
+            print(f"could not make thumbnail of {path=}: {e!r}") # todo logging
+            return
+        self.thumbnailReady.emit(generation, row, thumbnail) # delivered to slots on the GUI thread
+
+    def onThumbnailReady(self, generation: int, row: int, thumbnail: QtGui.QImage):
+        if generation != self.generation:
+            return
+        self.icons[row] = QtGui.QIcon(QtGui.QPixmap.fromImage(thumbnail))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def imagePath(self, index: QtCore.QModelIndex) -> str:
+        return self.images[index.row()][0]
@@ -1,9 +1,175 @@
 import json
+import os
 import pathlib
+import pickle
+from typing import Iterable
 
-import pandas as pd
+import numpy as np
 
+from profiling import timed
 
+# json file with implant info (in current working directory)
+IMPLANT_INFO_FILE = pathlib.Path("implant_info.json")
+
+# spreadsheet with surgery notes
+SURGERY_NOTES_XLSX = pathlib.Path(R'C:\Users\ben.hardcastle\OneDrive - Allen Institute\DR_Surgery_Dev_Tracking.xlsx')
+SURGERY_NOTES_SHEET = 'Survival Tracking'
+# parsed copy of the spreadsheet (in current working directory)
+SURGERY_NOTES_CACHE = pathlib.Path("surgery_notes_index.pkl")
+
+# in-memory copies of parsed surgery notes, {xlsx path: index dict}
+_surgery_notes_indexes = {}
+
+
+def file_signature(file: pathlib.Path) -> tuple:
+    """ identify the current version of a file without reading it - changes whenever the file is re-saved
+
+    Returns:
+        tuple: (path, modification time in ns, size in bytes)
+    """
+    stat = pathlib.Path(file).stat()
+    return (str(file), stat.st_mtime_ns, stat.st_size)
+
+
+def parse_surgery_notes(xlsx_file: pathlib.Path = SURGERY_NOTES_XLSX) -> dict:
+    """ read the surgery notes spreadsheet and reduce it to a mouseID -> implant description lookup
+
+    Returns:
+        dict:
+            "signature" (tuple): `file_signature` of the spreadsheet that was parsed
+            "descriptions" (dict): {mouseID (int): implant description (str)}
+            "duplicates" (set): mouseIDs with more than one row in the spreadsheet
+    """
+    import pandas as pd # slow to import, and only needed when the spreadsheet has changed
+
+    signature = file_signature(xlsx_file)
+
+    # only the two columns we need - much faster than parsing the whole sheet
+    df = pd.read_excel(xlsx_file, sheet_name=SURGERY_NOTES_SHEET, usecols=["MID", "Type"])
+    Warning("Using DR surgery spreadsheet copied locally - will not get updates")
+
+    # drop blank rows and notes in the MID column
+    df["MID"] = pd.to_numeric(df["MID"], errors="coerce")
+    df = df.dropna(subset=["MID"])
+    mids = df["MID"].astype(int)
+    descriptions = df["Type"].fillna("").astype(str)
+
+    duplicated = mids.duplicated(keep=False)
+    return {
+        "signature": signature,
+        "descriptions": dict(zip(mids[~duplicated].tolist(), descriptions[~duplicated].tolist())),
+        "duplicates": set(mids[duplicated].tolist()),
+    }
+
+
+def get_surgery_notes_index(xlsx_file: pathlib.Path = None, cache_file: pathlib.Path = None) -> dict:
+    """ get the parsed surgery notes, only re-reading the spreadsheet if it has changed since it was last parsed
+
+    checks, in order: the copy held in memory, the pickled copy in `cache_file`, then the spreadsheet itself.
+    defaults to SURGERY_NOTES_XLSX and SURGERY_NOTES_CACHE as they are when called, so they can be changed
+    (eg. by benchmarks) without passing paths through every lookup
+
+    Returns:
+        dict: see `parse_surgery_notes`, or None if the spreadsheet can't be found
+    """
+    xlsx_file = xlsx_file or SURGERY_NOTES_XLSX
+    cache_file = cache_file or SURGERY_NOTES_CACHE
+    if not pathlib.Path(xlsx_file).exists():
+        print(f"cannot find surgery notes spreadsheet\n{xlsx_file=}") # todo logging
+        return None
+
+    signature = file_signature(xlsx_file)
+
+    index = _surgery_notes_indexes.get(str(xlsx_file))
+    if index is not None and index["signature"] == signature:
+        return index
+
+    # a cache that can't be unpickled for any reason (truncated, from another version, ...) is just a miss
+    try:
+        with pathlib.Path(cache_file).open('rb') as f:
+            index = pickle.load(f)
+    except Exception:
+        index = None
+
+    if not isinstance(index, dict) or index.get("signature") != signature:
+        index = parse_surgery_notes(xlsx_file)
+        # written under a temporary name and renamed once complete, so readers never see a partial cache
+        cache_file = pathlib.Path(cache_file)
+        tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+        try:
+            with tmp_file.open('wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            print(f"could not write surgery notes cache\n{cache_file=}") # todo logging
+
+    _surgery_notes_indexes[str(xlsx_file)] = index
+    return index
+
+
+class ImplantClassifier:
+    """ finds the implant named in a free-text description from the surgery notes
+
+    all implants' search strings are flattened once into a single table, in precedence order, so each
+    description is checked with plain substring tests and no per-call list building
+
+    precedence: if a description contains search strings for more than one implant, the implant that comes
+    first in implant_info.json wins, regardless of where the strings appear in the description.
+    eg. "TS-4, replaces #42" -> #42, since "42" (index 0) is listed before "TS-4" (index 4)
+    """
+
+    def __init__(self, implants: list):
+        self.implants = implants
+        # (search string, position of implant in list), ordered by precedence
+        self.search_table = tuple(
+            (name, position) for position, i in enumerate(implants) for name in i["search_strings"]
+        )
+
+    def index(self, implant_description: str) -> int:
+        """ position in `implants` of the implant named in the description, or -1 if none matched """
+        for name, position in self.search_table:
+            if name in implant_description:
+                return position
+        return -1
+
+    def indices(self, implant_descriptions: Iterable[str]) -> np.ndarray:
+        """ `index` for many descriptions, as an int array - each distinct description is only checked once """
+        implant_descriptions = list(implant_descriptions)
+        lookup = {d: self.index(d) for d in set(implant_descriptions)}
+        return np.array([lookup[d] for d in implant_descriptions], dtype=int)
+
+    def classify(self, implant_description: str) -> dict:
+        """ implant info dict (see `get_implant_type`) for the implant named in the description, or None """
+        idx = self.index(implant_description)
+        return self.implants[idx] if idx >= 0 else None
+
+
+# in-memory classifiers, {json path: (file signature, ImplantClassifier)}
+_implant_classifiers = {}
+
+
+def get_implant_classifier(implant_info_file: pathlib.Path = IMPLANT_INFO_FILE) -> ImplantClassifier:
+    """ get a classifier for the implants in json file, only rebuilding it if the file has changed """
+    signature = file_signature(implant_info_file)
+
+    cached = _implant_classifiers.get(str(implant_info_file))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with pathlib.Path(implant_info_file).open() as json_file:
+        json_data = json.load(json_file)
+
+    classifier = ImplantClassifier(json_data["implants"])
+    _implant_classifiers[str(implant_info_file)] = (signature, classifier)
+    return classifier
+
+
+def get_implants(implant_info_file: pathlib.Path = IMPLANT_INFO_FILE) -> list:
+    """ list of known implants from json file, in the order they should be matched """
+    return get_implant_classifier(implant_info_file).implants
+
+
+@timed()
 def get_implant_type(mouseID: int) -> dict:
     """ scan a spreadsheet of surgery notes and find the implant used for a particular mouse, or return none
 
@@ -16,73 +182,112 @@ def get_implant_type(mouseID: int) -> dict:
             "type" (str): implant type, version, or nickname
             "search_strings": for searching elsewhere (eg implant template files)
     """
-    # open json file with implant info (in current working directory)
-    implant_info_file = pathlib.Path("implant_info.json")
-
-    with implant_info_file.open() as json_file:
-        json_data = json.load(json_file)
-        implants = json_data["implants"]
-
-    # open spreadsheet with surgery notes
-    xlsx_file = pathlib.Path(R'C:\Users\ben.hardcastle\OneDrive - Allen Institute\DR_Surgery_Dev_Tracking.xlsx')
+    classifier = get_implant_classifier()
 
-    if not pathlib.Path(xlsx_file).exists():
-        print(f"cannot find surgery notes spreadsheet\n{xlsx_file=}") # todo logging
+    # look up the mouse in the parsed surgery notes
+    index = get_surgery_notes_index()
+    if index is None:
         return None
 
-    # read implant surgery notes from specific sheet
-    df = pd.read_excel(xlsx_file, sheet_name='Survival Tracking')
-    Warning("Using DR surgery spreadsheet copied locally - will not get updates")
-
-    # look for a row with the corresponding mouseID and extract implant description cell
-    x = df[df["MID"].isin([int(mouseID)])]["Type"]
-
-    if len(x) > 1:
+    if int(mouseID) in index["duplicates"]:
         print(f"{mouseID=} has multiple rows in surgery notes") # todo logging
         return None
 
     try:
-        implant_description = x.to_numpy()[0]
-    except IndexError:
+        implant_description = index["descriptions"][int(mouseID)]
+    except KeyError:
         print(f"{mouseID=} not in surgery notes spreadsheet") # todo logging
         return None
 
-    for i in implants:
-        if any([name in implant_description for name in i["search_strings"]]):
-            return i
+    implant = classifier.classify(implant_description)
+    if implant is not None:
+        return implant
 
     # if we still haven't found any matches:
     print(f"{mouseID=} in surgery notes spreadsheet - no known type matched in {implant_description=}") # todo logging
     return None
 
 
+def get_implant_types(mouse_ids: Iterable[int]) -> dict:
+    """ find the implants used for many mice at once, with a single read of the surgery notes
+
+    same rules as `get_implant_type`: mice that are missing from the surgery notes, have multiple rows, or
+    have no recognizable implant description get None
+
+    Args:
+        mouse_ids (Iterable[int]): 6-digit ids
+
+    Returns:
+        dict: {mouseID (int): implant info dict (see `get_implant_type`) or None}
+    """
+    mouse_ids = [int(mouseID) for mouseID in mouse_ids]
+    implant_types = dict.fromkeys(mouse_ids)
+
+    index = get_surgery_notes_index()
+    if index is None:
+        return implant_types
+
+    classifier = get_implant_classifier()
+
+    # join requested ids against the surgery notes
+    found = [mouseID for mouseID in implant_types if mouseID in index["descriptions"]]
+
+    # classify all descriptions in one pass of the compiled classifier
+    implant_idx = classifier.indices(index["descriptions"][mouseID] for mouseID in found)
+
+    for mouseID, idx in zip(found, implant_idx):
+        if idx >= 0:
+            implant_types[mouseID] = classifier.implants[idx]
+
+    duplicates = [mouseID for mouseID in implant_types if mouseID in index["duplicates"]]
+    missing = [mouseID for mouseID in implant_types if mouseID not in found and mouseID not in duplicates]
+    unmatched = [mouseID for mouseID, idx in zip(found, implant_idx) if idx < 0]
+    if duplicates:
+        print(f"{duplicates=} have multiple rows in surgery notes") # todo logging
+    if missing:
+        print(f"{missing=} not in surgery notes spreadsheet") # todo logging
+    if unmatched:
+        print(f"{unmatched=} in surgery notes spreadsheet - no known type matched") # todo logging
+
+    return implant_types
+
+
 def make_implant_info_file():
-    """ last updated 2022-05-30"""
+    """ last updated 2022-05-30
+
+    hole coordinates, template images and brain areas for each implant's template (see implant_templates.py)
+    are still to be filled in from the implant drawings
+    """
     # todo
 
-    implant_info_file = pathlib.Path("implant_info.json")
+    implant_info_file = IMPLANT_INFO_FILE
 
     implant_info = {
         "implants": [{
             "index": 0,
             "type": "#42",
             "search_strings": ["foot", "ball", "42"],
+            "template": {"image": None, "holes": []},
         }, {
             "index": 1,
             "type": "TS-1",
             "search_strings": ["TS1", "TS-1"],
+            "template": {"image": None, "holes": []},
         }, {
             "index": 2,
             "type": "TS-2",
             "search_strings": ["TS2", "TS-2"],
+            "template": {"image": None, "holes": []},
         }, {
             "index": 3,
             "type": "TS-3",
             "search_strings": ["TS3", "TS-3"],
+            "template": {"image": None, "holes": []},
         }, {
             "index": 4,
             "type": "TS-4",
             "search_strings": ["TS4", "TS-4"],
+            "template": {"image": None, "holes": []},
         }]
     }
 
@@ -91,4 +296,5 @@ def make_implant_info_file():
         json.dump(implant_info, json_file, indent=4, ensure_ascii=False)
 
 
-print(f"{get_implant_type(612090)=}")
+if __name__ == '__main__':
+    print(f"{get_implant_type(612090)=}")